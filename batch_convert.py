@@ -0,0 +1,583 @@
+import os
+import abc
+import sys
+import time
+import glob
+import queue
+import argparse
+import functools
+import threading
+import collections
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+import logging
+from pdf_conversion import (BLANK_THRESHOLD, PAGE_TIMEOUT, PROCESS_CHUNK_PAGES, CancelFlag, ConversionCancelled,
+                            build_options, build_report, failed_result, init_worker, merge_page_stats, open_journal,
+                            open_writer, page_chunks, page_report, process_page_range, shutdown_executor,
+                            stall_timeout)
+from docx_conversion import convert_docx_to_searchable
+from pdf_optimize import check_linearize, linearize_pdf, optimize_pdf
+from conversion_stats import NULL_STATS, ConversionStats, write_stats
+from conversion_jobs import JobHandle
+from ocr_sidecars import SIDECAR_FORMATS, open_sidecars
+from source_files import open_source
+
+logging.basicConfig(level=logging.INFO)
+LOGGER = logging.getLogger(__name__)
+
+# Dispatched-but-unwritten pages allowed per pool worker before dispatching pauses
+PAGES_PER_WORKER = 2 * PROCESS_CHUNK_PAGES
+
+# Jobs that can be cancelled mid-chunk at once; past that a cancel only stops dispatching
+CANCEL_SLOTS = 256
+
+# How often the assembly thread looks for tasks that have run past their stall_timeout
+STALL_POLL_SECONDS = 1
+
+# Returned in place of a task's result when the task went back in the queue
+REQUEUED = object()
+
+
+class BatchJob(JobHandle, abc.ABC):
+    """One document queued on a PageScheduler; see conversion_jobs.JobHandle for waiting,
+    progress and cancelling. Callbacks run in the scheduler's assembly thread.
+    """
+
+    def __init__(self, path, output_path, cancel_token=None, cancel_slot=None):
+        super().__init__(path, output_path, cancel_token)
+        self.cancel_slot = cancel_slot
+        self.dispatched_pages = 0
+        self.written_pages = 0
+        self.pending = collections.deque()
+
+    @abc.abstractmethod
+    def next_task(self):
+        """Return (page count, fn, args) for the next piece of work to dispatch."""
+
+    @abc.abstractmethod
+    def deliver(self, result):
+        """Take the result of a finished task; called from the assembly thread only."""
+
+    def lost_task(self, args, error):
+        """What to deliver for a task, dispatched with args, whose worker died or hung: by
+        default the error, which fails the job."""
+        return error
+
+    def fail(self, error):
+        self._finish(error=error)
+
+
+class PdfBatchJob(BatchJob):
+    """A PDF OCRed chunk by chunk in the shared pool and written out in page order."""
+
+    def __init__(self, pdf_path, output_path, options, journal=False, optimize=False, stats_sink=None,
+                 cancel_token=None, cancel_slot=None, linearize=False):
+        super().__init__(pdf_path, output_path, cancel_token, cancel_slot)
+        self.options = options
+        self.optimize = optimize
+        self.linearize = linearize
+        self.stats_sink = stats_sink
+        self.stats = ConversionStats() if options["stats"] else NULL_STATS
+        with self.stats.time("open"):
+            # Mapped for the life of the job: the document, journal and writer share it
+            self.source = open_source(pdf_path)
+            try:
+                self.pdf_document = self.source.open_pdf()
+            except BaseException:
+                self.source.close()
+                raise
+        self.stats.count("bytes_in", self.source.size)
+        self.page_nums = list(range(self.pdf_document.page_count))
+        try:
+            self.journal = open_journal(pdf_path, output_path, options, 0, len(self.page_nums)) if journal else None
+            self.writer = open_writer(pdf_path, self.pdf_document, output_path, options, streaming=True,
+                                      stats=self.stats, source=self.source)
+        except BaseException:
+            self.pdf_document.close()
+            self.source.close()
+            raise
+        todo = [page_num for page_num in self.page_nums if not self.journal or page_num not in self.journal.completed]
+        self.pending.extend(page_chunks(todo, 1))
+        self.sidecars = open_sidecars(output_path, options["sidecars"])
+        self.buffer = {}
+        self.next_index = 0
+        self.page_reports = []
+        self.update_progress(done=0, total=len(self.page_nums))
+
+    def next_task(self):
+        chunk = self.pending.popleft()
+        if self.stage == "queued":
+            self.update_progress(stage="ocr")
+        return len(chunk), process_page_range, (self.path, chunk, self.options, self.cancel_slot)
+
+    def lost_task(self, args, error):
+        # Only the chunk's pages are lost; they are passed through like any failed page
+        return [(page_num, failed_result(error)) for page_num in args[1]]
+
+    def deliver(self, results):
+        for page_num, ocr_result in results or []:
+            self.buffer[page_num] = ocr_result
+        # Write every page that is now next in line
+        while self.next_index < len(self.page_nums):
+            page_num = self.page_nums[self.next_index]
+            if page_num in self.buffer:
+                ocr_result = self.buffer.pop(page_num)
+                if self.journal and ocr_result and ocr_result["status"] != "failed":
+                    self.journal.record(page_num, ocr_result)
+                self.written_pages += 1
+            elif self.journal and page_num in self.journal.completed:
+                ocr_result = self.journal.load(page_num)
+            else:
+                break
+            self.page_reports.append(page_report(page_num, ocr_result))
+            merge_page_stats(self.stats, ocr_result)
+            self.writer.add(page_num, ocr_result)
+            if self.sidecars:
+                with self.stats.time("sidecars"):
+                    self.sidecars.add(page_num, ocr_result, self.pdf_document)
+            self.next_index += 1
+            self.update_progress(done=self.next_index)
+        if self.next_index == len(self.page_nums):
+            self.update_progress(stage="write")
+            self.pdf_document.close()
+            # The streaming writer has copied every source page it needs already
+            self.source.close()
+            self.writer.close()
+            if self.journal:
+                self.journal.finish()
+            report = build_report(self.page_reports)
+            if self.optimize:
+                self.update_progress(stage="optimize")
+                with self.stats.time("optimize"):
+                    report["optimize"] = optimize_pdf(self.output_path)
+            if self.linearize:
+                self.update_progress(stage="linearize")
+                with self.stats.time("linearize"):
+                    report["linearize"] = linearize_pdf(self.output_path)
+            if self.sidecars:
+                report["sidecars"] = self.sidecars.close()
+            if self.stats.enabled:
+                self.stats.count("bytes_out", os.path.getsize(self.output_path))
+                report["stats"] = self.stats.as_dict()
+                write_stats(self.stats_sink, report["stats"], document=os.path.abspath(self.path),
+                            output=os.path.abspath(self.output_path))
+            self._finish(report=report)
+
+    def fail(self, error):
+        if not self.pdf_document.is_closed:
+            self.pdf_document.close()
+            self.source.close()
+            self.writer.abort()
+            if self.sidecars:
+                self.sidecars.abort()
+        if self.journal:
+            # A cancelled conversion is abandoned, not left to be resumed
+            if isinstance(error, ConversionCancelled):
+                self.journal.finish()
+            else:
+                self.journal.close()
+        super().fail(error)
+
+
+class DocxBatchJob(BatchJob):
+    """A DOCX converted as a single task in the shared pool."""
+
+    def __init__(self, docx_path, output_path, options, cancel_token=None, cancel_slot=None):
+        super().__init__(docx_path, output_path, cancel_token, cancel_slot)
+        self.options = options
+        self.pending.append(None)
+        self.update_progress(done=0, total=1)
+
+    def next_task(self):
+        self.pending.popleft()
+        self.update_progress(stage="ocr")
+        return 1, convert_docx_to_searchable, (self.path, self.output_path, self.options["ocr_cache"],
+                                               self.options["sidecars"])
+
+    def deliver(self, result):
+        self.written_pages += 1
+        self.update_progress(done=1)
+        self._finish(report={"output": self.output_path})
+
+
+class PoolTask:
+    """A piece of a job's work dispatched to the pool, kept until its result is taken.
+
+    alone marks a task that was in flight when a worker died: it is run again with
+    nothing else in the pool, so a task that kills its worker can be told apart from
+    the ones lost with it.
+    """
+
+    def __init__(self, job, pages, fn, args, alone=False):
+        self.job = job
+        self.pages = pages
+        self.fn = fn
+        self.args = args
+        self.alone = alone
+        self.executor = None
+        self.started = None  # when the pool was first seen running it
+
+
+class PageScheduler:
+    """Feed pages from every queued document into one fixed-size process pool.
+
+    PDFs are split into page chunks that are dispatched round-robin across documents, so
+    a 2,000-page file cannot starve a 3-page one, and every page competes for the same
+    jobs worker processes however many files are queued. At most jobs x PAGES_PER_WORKER
+    dispatched pages may wait to be written at any time, keeping memory flat. A single
+    assembly thread writes each document's pages in order as they complete.
+    optimize=True recompresses each finished PDF (see pdf_optimize.optimize_pdf), and
+    stats_sink sends each PDF's stage stats to a JSON lines or Prometheus textfile (see
+    conversion_stats.write_stats). linearize=True then rewrites each finished PDF for
+    fast web view (see pdf_optimize.linearize_pdf); RuntimeError is raised straight away
+    when that cannot be done here.
+
+    One bad page does not take the pool down with it. When a worker dies (its memory cap
+    or a crash) the pool is replaced and the tasks lost with it run again, the ones that
+    were in flight one at a time; a task that kills a worker on its own has its pages
+    passed through as failed. A task running longer than its stall_timeout is given up
+    on the same way, and the pool is replaced to stop it.
+
+    Cancelling a job drops its undispatched chunks and fails it with ConversionCancelled
+    straight away; its chunks already in the pool stop at their next page or OCR call, so
+    the workers move on to the next document.
+    """
+
+    def __init__(self, jobs=None, journal=False, optimize=False, stats_sink=None, linearize=False, **options):
+        if linearize:
+            check_linearize()
+        self.jobs = jobs or os.cpu_count() or 1
+        self.journal = journal
+        self.optimize = optimize
+        self.linearize = linearize
+        self.stats_sink = stats_sink
+        if stats_sink:
+            options["stats"] = True
+        self.options = build_options(**options)
+        self.max_unwritten = self.jobs * PAGES_PER_WORKER
+        self.cancel_flags = multiprocessing.Array("b", CANCEL_SLOTS, lock=False)
+        self.free_slots = collections.deque(range(CANCEL_SLOTS))
+        self.executor = self._new_executor()
+        self.retired = {}  # replaced pools and why: "crashed" or "stalled"
+        self.condition = threading.Condition()
+        self.active = collections.deque()  # jobs with work left to dispatch, in turn order
+        self.retry = collections.deque()  # tasks lost with a replaced pool, dispatched first
+        self.outstanding = {}  # future -> PoolTask, for every task in the pool
+        self.live = set()  # jobs not finished yet
+        self.closed = False
+        self.results = queue.Queue()
+        self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        self.assembler = threading.Thread(target=self._assemble, daemon=True)
+        self.dispatcher.start()
+        self.assembler.start()
+
+    def _new_executor(self):
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs, initializer=init_worker,
+                                                      initargs=(self.options["max_memory"], None, self.cancel_flags))
+
+    def _retire_executor(self, reason):
+        """Replace the pool; called with the condition held."""
+        old = self.executor
+        self.retired[old] = reason
+        # Without waiting: a crashed pool's workers are gone already, and a hung worker
+        # can only be stopped by terminating the pool's processes
+        shutdown_executor(old, stalled=True)
+        self.executor = self._new_executor()
+
+    def submit(self, path, output_path):
+        """Queue a PDF or DOCX for conversion and return its BatchJob."""
+        with self.condition:
+            slot = self.free_slots.popleft() if self.free_slots else None
+        token = CancelFlag(self.cancel_flags, slot) if slot is not None else None
+        if token:
+            token.clear()
+        try:
+            if path.lower().endswith(".docx"):
+                job = DocxBatchJob(path, output_path, self.options, token, slot)
+            else:
+                job = PdfBatchJob(path, output_path, self.options, self.journal, self.optimize, self.stats_sink,
+                                  token, slot, self.linearize)
+        except BaseException:
+            self._release_slot(slot)
+            raise
+        job.on_cancel = functools.partial(self._cancel, job)
+        with self.condition:
+            if self.closed:
+                self._release_slot(slot)
+                raise RuntimeError("PageScheduler is closed")
+            self.live.add(job)
+            if job.pending:
+                self.active.append(job)
+                self.condition.notify_all()
+            else:
+                # Nothing left to OCR (empty or fully journaled), only assembly
+                self.results.put((job, None))
+        return job
+
+    def _release_slot(self, slot):
+        if slot is not None:
+            with self.condition:
+                self.free_slots.append(slot)
+
+    def _cancel(self, job):
+        with self.condition:
+            job.pending.clear()
+            if job in self.active:
+                self.active.remove(job)
+        # The assembly thread owns the job's writer, so it does the failing
+        self.results.put((job, ConversionCancelled("Conversion cancelled")))
+
+    def _unwritten(self):
+        return sum(job.dispatched_pages - job.written_pages for job in self.live)
+
+    def _next_task(self):
+        """Wait for the next task to dispatch, or return None once closed and drained."""
+        while True:
+            if self.retry:
+                # A task that may have killed a worker waits for the pool to empty
+                if not self.retry[0].alone or not self.outstanding:
+                    return self.retry.popleft()
+            elif self.active and self._unwritten() < self.max_unwritten:
+                job = self.active.popleft()
+                pages, fn, args = job.next_task()
+                job.dispatched_pages += pages
+                if job.pending:
+                    self.active.append(job)  # back of the line: round-robin
+                return PoolTask(job, pages, fn, args)
+            elif self.closed and not self.active and not self.outstanding:
+                # Outstanding tasks may yet come back to be run again
+                return None
+            self.condition.wait()
+
+    def _dispatch(self):
+        while True:
+            with self.condition:
+                task = self._next_task()
+                if task is None:
+                    return
+                if task.job.done.is_set():
+                    continue  # cancelled while waiting to run again
+                task.executor = self.executor
+                try:
+                    future = self.executor.submit(task.fn, *task.args)
+                except RuntimeError as e:  # pool shut down or broken underneath us
+                    future = concurrent.futures.Future()
+                    future.set_exception(e)
+                self.outstanding[future] = task
+            future.add_done_callback(self._task_done)
+
+    def _task_done(self, future):
+        self.results.put((None, future))
+
+    def _settle(self, future):
+        """Take a finished future's task out of the pool's books; None if it was given up on."""
+        with self.condition:
+            task = self.outstanding.pop(future, None)
+            self.condition.notify_all()
+        return task
+
+    def _task_result(self, task, future):
+        """Return a finished task's result, raising its error.
+
+        A task whose pool was replaced under it is queued again and REQUEUED returned:
+        alone when it was running as a worker died, as before otherwise. One that kills a
+        worker while running alone is lost (see BatchJob.lost_task).
+        """
+        error = None if future.cancelled() else future.exception()
+        if not future.cancelled() and not isinstance(error, BrokenProcessPool):
+            return future.result()
+        with self.condition:
+            if error is not None and task.executor is self.executor:
+                self._retire_executor("crashed")
+            reason = self.retired.get(task.executor)
+            if reason is None:
+                return future.result()  # cancelled by close(wait=False)
+            if error is None or reason == "stalled" or not task.alone:
+                # Either it never ran, or it may be innocent: run it again
+                self.retry.append(PoolTask(task.job, task.pages, task.fn, task.args,
+                                           alone=error is not None and reason == "crashed"))
+                self.condition.notify_all()
+                return REQUEUED
+        LOGGER.error(f"Conversion of {task.job.path} killed a worker process: {error}")
+        return task.job.lost_task(task.args, RuntimeError("worker process died"))
+
+    def _check_stalls(self):
+        """Give up on tasks that have run past their stall_timeout; assembly thread only."""
+        now = time.monotonic()
+        with self.condition:
+            hung = []
+            for future, task in self.outstanding.items():
+                if task.started is None:
+                    if future.running():
+                        task.started = now
+                    continue
+                limit = stall_timeout(self.options, task.pages)
+                if limit and now - task.started > limit:
+                    hung.append(future)
+            hung = [self.outstanding.pop(future) for future in hung]
+            if any(task.executor is self.executor for task in hung):
+                # Other tasks running in the pool go back in the queue
+                self._retire_executor("stalled")
+            if hung:
+                self.condition.notify_all()
+        for task in hung:
+            if task.job.done.is_set():
+                continue
+            LOGGER.error(f"Conversion of {task.job.path} hung and its pages are passed through un-OCRed")
+            self._deliver(task.job, task.job.lost_task(task.args, TimeoutError("worker hung")))
+
+    def _deliver(self, job, outcome, task=None):
+        """Hand job a result, or fail it with the error outcome is or raises. With task,
+        outcome is the task's finished future (see _task_result)."""
+        try:
+            if task is not None:
+                outcome = self._task_result(task, outcome)
+                if outcome is REQUEUED:
+                    return
+            if isinstance(outcome, Exception):
+                raise outcome
+            job.deliver(outcome)
+        except ConversionCancelled as e:
+            LOGGER.info(f"Conversion cancelled: {job.path}")
+            job.fail(e)
+        except Exception as e:
+            LOGGER.error(f"Conversion failed: {job.path} - {e}")
+            job.fail(e)
+        with self.condition:
+            if job.done.is_set():
+                self.live.discard(job)
+                if job in self.active:
+                    self.active.remove(job)
+                # Chunks of a cancelled job still in the pool stop only while its flag
+                # is set, so slots are reused oldest-first
+                if job.cancel_slot is not None:
+                    self.free_slots.append(job.cancel_slot)
+            self.condition.notify_all()
+
+    def _assemble(self):
+        while True:
+            try:
+                item = self.results.get(timeout=STALL_POLL_SECONDS)
+            except queue.Empty:
+                item = False
+            self._check_stalls()
+            if item is None:
+                return
+            if item is False:
+                continue
+            job, outcome = item
+            task = None
+            if isinstance(outcome, concurrent.futures.Future):
+                task = self._settle(outcome)
+                if task is None:
+                    continue  # given up on as hung; its pages are written already
+                job = task.job
+            if job.done.is_set():
+                continue  # late result for a job that already failed
+            self._deliver(job, outcome, task)
+
+    def close(self, wait=True):
+        """Stop accepting documents; with wait, finish every queued one first."""
+        with self.condition:
+            self.closed = True
+            if not wait:
+                self.active.clear()
+                self.retry.clear()
+            self.condition.notify_all()
+            jobs = list(self.live)
+        if wait:
+            for job in jobs:
+                job.done.wait()
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+        self.results.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(wait=exc_type is None)
+
+
+def expand_paths(patterns):
+    """Expand files, directories and glob patterns into the PDF and DOCX files they name."""
+    paths = []
+    for pattern in patterns:
+        for match in sorted(glob.glob(pattern, recursive=True)) or [pattern]:
+            if os.path.isdir(match):
+                for root, dirs, files in os.walk(match):
+                    paths.extend(os.path.join(root, file) for file in sorted(files))
+            else:
+                paths.append(match)
+    return [path for path in paths if path.lower().endswith(('.pdf', '.docx'))]
+
+def output_path_for(path, output_dir):
+    """Name outputs the way the desktop app does."""
+    name = os.path.basename(path)
+    if name.lower().endswith(".pdf"):
+        return os.path.join(output_dir, name[:-4] + "_converted.pdf")
+    return os.path.join(output_dir, name[:-5] + "_searchable.docx")
+
+def parse_dpi(value):
+    return value if value == "auto" else int(value)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m batch_convert",
+                                     description="Convert many documents through one shared OCR worker pool.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert_parser = commands.add_parser("convert", help="convert PDF/DOCX files, directories or globs")
+    convert_parser.add_argument("paths", nargs="+")
+    convert_parser.add_argument("--jobs", "-j", type=int, default=None, help="worker processes (default: all cores)")
+    convert_parser.add_argument("--output-dir", default="converted")
+    convert_parser.add_argument("--dpi", type=parse_dpi, default=111, help="render dpi or 'auto'")
+    convert_parser.add_argument("--output-mode", choices=("pdf", "overlay"), default="pdf")
+    convert_parser.add_argument("--journal", action="store_true", help="checkpoint pages so reruns resume")
+    convert_parser.add_argument("--min-confidence", type=float, default=None,
+                                help="re-OCR pages whose mean word confidence is below this at 300 dpi")
+    convert_parser.add_argument("--blank-threshold", type=float, default=BLANK_THRESHOLD,
+                                help="ink/edge share below which a scanned page is skipped as blank")
+    convert_parser.add_argument("--ocr-blank-pages", action="store_true", help="OCR blank pages too")
+    convert_parser.add_argument("--page-timeout", type=float, default=PAGE_TIMEOUT,
+                                help="seconds a single OCR call on a page may take")
+    convert_parser.add_argument("--max-memory-mb", type=int, default=None, help="address space cap per worker process")
+    convert_parser.add_argument("--auto-rotate", action="store_true", help="turn sideways and upside-down scans upright")
+    convert_parser.add_argument("--stats-sink", default=None,
+                                help="append per-document stage stats to this JSON lines file (.prom: Prometheus textfile)")
+    convert_parser.add_argument("--optimize", action="store_true", help="recompress page images in the output")
+    convert_parser.add_argument("--linearize", action="store_true", help="write linearized (fast web view) PDFs")
+    convert_parser.add_argument("--sidecars", default="",
+                                help=f"comma-separated text sidecars to write next to each output ({', '.join(SIDECAR_FORMATS)})")
+    args = parser.parse_args(argv)
+
+    paths = expand_paths(args.paths)
+    if not paths:
+        parser.error("no PDF or DOCX files matched")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    failures = 0
+    blank_threshold = None if args.ocr_blank_pages else args.blank_threshold
+    with PageScheduler(jobs=args.jobs, journal=args.journal, optimize=args.optimize, stats_sink=args.stats_sink,
+                       linearize=args.linearize,
+                       dpi=args.dpi, min_confidence=args.min_confidence, auto_rotate=args.auto_rotate,
+                       blank_threshold=blank_threshold, page_timeout=args.page_timeout,
+                       max_memory=args.max_memory_mb and args.max_memory_mb * 1024 * 1024,
+                       output_mode=args.output_mode,
+                       sidecars=[fmt.strip() for fmt in args.sidecars.split(",") if fmt.strip()]) as scheduler:
+        jobs = []
+        for path in paths:
+            try:
+                jobs.append(scheduler.submit(path, output_path_for(path, args.output_dir)))
+            except Exception as e:
+                LOGGER.error(f"Cannot queue {path}: {e}")
+                failures += 1
+        for job in jobs:
+            job.done.wait()
+            if job.error:
+                failures += 1
+            else:
+                LOGGER.info(f"Converted {job.path} -> {job.output_path}")
+    LOGGER.info(f"{len(paths) - failures} of {len(paths)} documents converted")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
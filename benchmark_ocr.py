@@ -0,0 +1,301 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import difflib
+import platform
+import argparse
+import subprocess
+import multiprocessing
+import concurrent.futures
+import logging
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from docx import Document
+from docx.shared import Inches
+from pdf_conversion import DEFAULT_DPI, convert_scanned_pdf_to_ocr
+from conversion_stats import ConversionStats
+from docx_conversion import convert_docx_to_searchable
+
+try:
+    import resource
+except ImportError:  # not on Windows; peak RSS is reported as None there
+    resource = None
+
+logging.basicConfig(level=logging.INFO)
+LOGGER = logging.getLogger(__name__)
+
+# Synthetic scans: Letter pages at a resolution picked per page from SCAN_DPIS, 11pt text,
+# turned by up to MAX_SKEW degrees, with Gaussian sensor noise and dust specks
+SCAN_DPIS = (150, 200, 300)
+FONT_POINTS = 11
+MAX_SKEW = 1.5
+NOISE_STD = 12
+SPECK_SHARE = 0.0005
+JPEG_QUALITY = 85
+
+# Tried in order for the page text; Pillow's own font is the fallback
+FONT_FILES = ("DejaVuSans.ttf", "arial.ttf", "Arial.ttf")
+
+WORDS = (
+    "the of and to in is was for on that with as by at from this be are or an have not which his were but "
+    "they had one all their there been has its more when will would who so no she other into some than them "
+    "these may then do first any my now such like our over man me even most made after also did many before "
+    "must through back years where much your way well down should because each just those people how too "
+    "little state good very make world still own see men work long get here between both life being under "
+    "never day same another know while last might us great old year off come since against go came right "
+    "used take three application certificate district registration 2024 number account address office "
+    "government payment section clause schedule reference total amount received verified signature"
+).split()
+
+MANIFEST = "manifest.json"
+PERCENTILES = (50, 90, 99)
+
+
+def page_font(size):
+    for name in FONT_FILES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default(size=size)
+
+def page_lines(rng, font, width):
+    """Random lines of text from WORDS, each wrapped to fit width pixels."""
+    lines = []
+    for _ in range(rng.randint(25, 40)):
+        line = []
+        while True:
+            word = rng.choice(WORDS)
+            if font.getlength(" ".join(line + [word])) > width:
+                break
+            line.append(word)
+        lines.append(" ".join(line))
+    return lines
+
+def render_scan(rng, np_rng):
+    """Render one synthetic scanned page; returns (grayscale image, ground truth, dpi, skew)."""
+    dpi = rng.choice(SCAN_DPIS)
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    margin = dpi  # one inch
+    font = page_font(round(FONT_POINTS * dpi / 72))
+    lines = page_lines(rng, font, width - 2 * margin)
+    img = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(img)
+    line_height = round(FONT_POINTS * 1.6 * dpi / 72)
+    for i, line in enumerate(lines):
+        draw.text((margin, margin + i * line_height), line, fill=0, font=font)
+    skew = round(rng.uniform(-MAX_SKEW, MAX_SKEW), 2)
+    img = img.rotate(skew, resample=Image.BICUBIC, fillcolor=255)
+    pixels = np.asarray(img, dtype=np.float32) + np_rng.normal(0, NOISE_STD, (height, width))
+    pixels[np_rng.random((height, width)) < SPECK_SHARE] = 0
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    img.info["dpi"] = (dpi, dpi)
+    return img, "\n".join(lines), dpi, skew
+
+def jpeg_bytes(img):
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=JPEG_QUALITY, dpi=img.info["dpi"])
+    return buffer.getvalue()
+
+def generate_corpus(corpus_dir, pdfs=4, pages=5, docx=2, seed=0):
+    """Write synthetic scanned PDFs and DOCX files with a manifest of their ground truth."""
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    documents = []
+    for kind, count in (("pdf", pdfs), ("docx", docx)):
+        for index in range(count):
+            name = f"scan_{index:03d}.{kind}"
+            scans = [render_scan(rng, np_rng) for _ in range(pages)]
+            if kind == "pdf":
+                pdf_document = fitz.open()
+                for img, _, _, _ in scans:
+                    page = pdf_document.new_page(width=612, height=792)
+                    page.insert_image(page.rect, stream=jpeg_bytes(img))
+                pdf_document.save(os.path.join(corpus_dir, name))
+                pdf_document.close()
+            else:
+                word_document = Document()
+                for i, (img, _, _, _) in enumerate(scans):
+                    if i:
+                        word_document.add_page_break()
+                    word_document.add_picture(io.BytesIO(jpeg_bytes(img)), width=Inches(6.5))
+                word_document.save(os.path.join(corpus_dir, name))
+            documents.append({"path": name, "kind": kind,
+                              "pages": [{"text": text, "dpi": dpi, "skew": skew} for _, text, dpi, skew in scans]})
+    manifest = {"seed": seed, "documents": documents}
+    with open(os.path.join(corpus_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    LOGGER.info(f"Generated {len(documents)} documents in {corpus_dir}")
+    return manifest
+
+def load_manifest(corpus_dir):
+    with open(os.path.join(corpus_dir, MANIFEST), encoding="utf-8") as f:
+        return json.load(f)
+
+def char_accuracy(truth, recognized):
+    """1 - character error rate of recognized against truth, with whitespace normalised."""
+    truth, recognized = " ".join(truth.split()), " ".join(recognized.split())
+    if not truth:
+        return 1.0 if not recognized else 0.0
+    matcher = difflib.SequenceMatcher(None, truth, recognized, autojunk=False)
+    errors = sum(max(i2 - i1, j2 - j1) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal")
+    return max(0.0, 1 - errors / len(truth))
+
+def output_accuracies(document, output_path):
+    """Per-page character accuracy of a converted document against the manifest."""
+    truths = [page["text"] for page in document["pages"]]
+    if document["kind"] == "pdf":
+        with fitz.open(output_path) as pdf_document:
+            texts = [page.get_text("text") for page in pdf_document]
+        texts += [""] * (len(truths) - len(texts))
+        return [char_accuracy(truth, text) for truth, text in zip(truths, texts)]
+    # Images come out of a DOCX in no set order, so score each page against its best paragraph
+    paragraphs = [paragraph.text for paragraph in Document(output_path).paragraphs] or [""]
+    return [max(char_accuracy(truth, text) for text in paragraphs) for truth in truths]
+
+def percentiles(values):
+    if not values:
+        return None
+    summary = {f"p{p}": round(float(np.percentile(values, p)), 4) for p in PERCENTILES}
+    summary["mean"] = round(float(np.mean(values)), 4)
+    return summary
+
+def peak_rss():
+    """Peak resident set size in bytes of this process and of its largest child, or Nones."""
+    if resource is None:
+        return None, None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit)
+
+def run_config(corpus_dir, output_dir, workers, dpi, backend, options):
+    """Convert the whole corpus with one configuration; runs in a fresh process so that
+    peak RSS belongs to this configuration alone."""
+    manifest = load_manifest(corpus_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    latencies, accuracies = [], []
+    page_seconds = {}
+    stage_totals = ConversionStats()
+    pages = failed = failed_documents = 0
+    started = time.perf_counter()
+    for document in manifest["documents"]:
+        source = os.path.join(corpus_dir, document["path"])
+        output_path = os.path.join(output_dir, document["path"])
+        pages += len(document["pages"])
+        document_started = time.perf_counter()
+        try:
+            if document["kind"] == "pdf":
+                report = convert_scanned_pdf_to_ocr(source, output_path, dpi=dpi, workers=workers, backend=backend,
+                                                    ocr_cache=None, stats=True, **options)
+                failed += report["failed_pages"]
+                stage_totals.merge(report["stats"])
+                for page in report["pages"]:
+                    for stage, seconds in page.get("seconds", {}).items():
+                        page_seconds.setdefault(stage, []).append(seconds)
+            else:
+                convert_docx_to_searchable(source, output_path, ocr_cache=None)
+        except Exception as e:
+            LOGGER.error(f"Converting {document['path']} failed - {e}")
+            failed_documents += 1
+            failed += len(document["pages"])
+            accuracies.extend([0.0] * len(document["pages"]))
+            continue
+        latencies.append(time.perf_counter() - document_started)
+        accuracies.extend(output_accuracies(document, output_path))
+    seconds = time.perf_counter() - started
+    peak_rss_bytes, peak_child_rss_bytes = peak_rss()
+    return {"workers": workers, "dpi": dpi, "backend": backend, "pages": pages, "failed_pages": failed,
+            "failed_documents": failed_documents,
+            "seconds": round(seconds, 3), "pages_per_sec": round(pages / seconds, 3) if seconds else None,
+            "document_latency": percentiles(latencies), "char_accuracy": percentiles(accuracies),
+            "page_stage_seconds": {stage: percentiles(values) for stage, values in page_seconds.items()},
+            "stats": stage_totals.as_dict(),
+            "peak_rss_bytes": peak_rss_bytes, "peak_child_rss_bytes": peak_child_rss_bytes}
+
+def in_fresh_process(fn, *args):
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(fn, *args).result()
+
+def current_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(corpus_dir, output_dir, workers_list=(1, 2, 4), dpis=(DEFAULT_DPI,), backend="process",
+                  **options):
+    """Benchmark every workers x dpi configuration on the corpus and return the results.
+
+    options are passed on to convert_scanned_pdf_to_ocr; the OCR cache is always off so
+    every run does the full work. Per-page stage latencies come from the converter's own
+    stats (see conversion_stats), so they are measured under the run's real concurrency.
+    """
+    manifest = load_manifest(corpus_dir)
+    results = {
+        "commit": current_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "corpus": {"seed": manifest["seed"], "documents": len(manifest["documents"]),
+                   "pages": sum(len(document["pages"]) for document in manifest["documents"])},
+        "options": options,
+        "runs": [],
+    }
+    for dpi in dpis:
+        for workers in workers_list:
+            LOGGER.info(f"Converting corpus with workers={workers} dpi={dpi} backend={backend}")
+            run_dir = os.path.join(output_dir, f"w{workers}_dpi{dpi}")
+            results["runs"].append(in_fresh_process(run_config, corpus_dir, run_dir, workers, dpi, backend, options))
+    return results
+
+def parse_dpi(value):
+    return value if value == "auto" else int(value)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmark_ocr",
+                                     description="Benchmark the OCR converters on synthetic scanned documents.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate_parser = commands.add_parser("generate", help="write a synthetic corpus with ground truth")
+    generate_parser.add_argument("corpus_dir")
+    generate_parser.add_argument("--pdfs", type=int, default=4)
+    generate_parser.add_argument("--docx", type=int, default=2)
+    generate_parser.add_argument("--pages", type=int, default=5, help="pages per document")
+    generate_parser.add_argument("--seed", type=int, default=0)
+    run_parser = commands.add_parser("run", help="benchmark the converters on a corpus")
+    run_parser.add_argument("corpus_dir")
+    run_parser.add_argument("--output", default=os.path.join("benchmark_output", "benchmark.json"),
+                            help="results JSON file (default: %(default)s)")
+    run_parser.add_argument("--work-dir", default="benchmark_output", help="converted documents")
+    run_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    run_parser.add_argument("--dpi", type=parse_dpi, nargs="+", default=[DEFAULT_DPI])
+    run_parser.add_argument("--backend", choices=("thread", "process", "pipeline"), default="process")
+    run_parser.add_argument("--output-mode", choices=("pdf", "overlay"), default="pdf")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        generate_corpus(args.corpus_dir, pdfs=args.pdfs, pages=args.pages, docx=args.docx, seed=args.seed)
+        return 0
+    if not os.path.exists(os.path.join(args.corpus_dir, MANIFEST)):
+        parser.error(f"{args.corpus_dir} has no {MANIFEST}; run 'generate' first")
+    results = run_benchmark(args.corpus_dir, args.work_dir, args.workers, args.dpi, args.backend,
+                            output_mode=args.output_mode)
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    for run in results["runs"]:
+        LOGGER.info(f"workers={run['workers']} dpi={run['dpi']}: {run['pages_per_sec']} pages/sec, "
+                    f"accuracy {run['char_accuracy'] and run['char_accuracy']['mean']}")
+    LOGGER.info(f"Results written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+import time
+import asyncio
+import threading
+import multiprocessing
+import logging
+from pdf_conversion import ConversionCancelled, convert_scanned_pdf_to_ocr
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class JobHandle:
+    """A document conversion running in the background.
+
+    done is set once the output has been written, the conversion failed or it was
+    cancelled; wait() returns the conversion report or raises the error, and
+    wait_async() (or awaiting the job) does the same from asyncio. cancel() sets the
+    job's cancel token, which workers check between pages and before every OCR call; the
+    job then fails with ConversionCancelled.
+
+    progress() returns pages done and total, the current stage ("queued", "ocr", "write",
+    "optimize", "linearize", "done", "failed" or "cancelled"), seconds elapsed and an ETA. Callbacks
+    added with add_progress_callback() get that dict after every page and stage change,
+    and add_done_callback() ones get the job when it finishes; both run in the thread
+    doing the conversion. progress_events() streams the same dicts to asyncio code.
+    """
+
+    def __init__(self, path, output_path, cancel_token=None):
+        self.path = path
+        self.output_path = output_path
+        self.done = threading.Event()
+        self.report = None
+        self.error = None
+        self.cancel_token = cancel_token if cancel_token is not None else threading.Event()
+        self.on_cancel = None  # set by whoever runs the job to stop work not yet started
+        self.total_pages = None
+        self.pages_done = 0
+        self.stage = "queued"
+        self.started = None
+        self._callbacks = []
+        self._progress_callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def progress(self):
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        eta = None
+        if self.total_pages and self.pages_done and not self.done.is_set():
+            eta = round(elapsed / self.pages_done * (self.total_pages - self.pages_done), 1)
+        return {"path": self.path, "done": self.pages_done, "total": self.total_pages, "stage": self.stage,
+                "elapsed": round(elapsed, 1), "eta": eta}
+
+    def update_progress(self, done=None, total=None, stage=None):
+        """Record progress and tell the progress callbacks; called by the job's runner."""
+        if done is not None:
+            self.pages_done = done
+        if total is not None:
+            self.total_pages = total
+        if stage is not None:
+            self.stage = stage
+            if self.started is None and stage != "queued":
+                self.started = time.monotonic()
+        progress = self.progress()
+        with self._callbacks_lock:
+            callbacks = list(self._progress_callbacks)
+        for fn in callbacks:
+            try:
+                fn(progress)
+            except Exception as e:
+                LOGGER.error(f"Progress callback for {self.path} failed: {e}")
+
+    def add_progress_callback(self, fn):
+        with self._callbacks_lock:
+            self._progress_callbacks.append(fn)
+
+    def add_done_callback(self, fn):
+        with self._callbacks_lock:
+            if not self.done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    @property
+    def cancelled(self):
+        return isinstance(self.error, ConversionCancelled)
+
+    def cancel(self):
+        """Stop the conversion as soon as possible; returns False if it already finished."""
+        if self.done.is_set():
+            return False
+        self.cancel_token.set()
+        if self.on_cancel:
+            self.on_cancel()
+        return True
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError(f"Conversion of {self.path} did not finish in time")
+        if self.error:
+            raise self.error
+        return self.report
+
+    async def wait_async(self):
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+        self.add_done_callback(lambda job: loop.call_soon_threadsafe(_resolve, finished))
+        await finished
+        return self.wait(0)
+
+    def __await__(self):
+        return self.wait_async().__await__()
+
+    async def progress_events(self):
+        """Yield progress dicts as they happen until the job finishes."""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        self.add_progress_callback(lambda progress: loop.call_soon_threadsafe(events.put_nowait, progress))
+        self.add_done_callback(lambda job: loop.call_soon_threadsafe(events.put_nowait, None))
+        while True:
+            event = await events.get()
+            if event is None:
+                return
+            yield event
+
+    def _finish(self, report=None, error=None):
+        self.report = report
+        self.error = error
+        self.update_progress(stage="cancelled" if isinstance(error, ConversionCancelled) else
+                             "failed" if error else "done")
+        with self._callbacks_lock:
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                LOGGER.error(f"Completion callback for {self.path} failed: {e}")
+
+
+class ConversionJob(JobHandle):
+    """convert_scanned_pdf_to_ocr running in its own thread; see start_conversion."""
+
+    def __init__(self, pdf_path, output_path):
+        # A multiprocessing Event reaches process-pool workers as well as threads
+        super().__init__(pdf_path, output_path, cancel_token=multiprocessing.Event())
+
+    def _run(self, kwargs):
+        try:
+            report = convert_scanned_pdf_to_ocr(self.path, self.output_path, cancel=self.cancel_token,
+                                                progress=self._conversion_progress, **kwargs)
+        except BaseException as e:
+            self._finish(error=e)
+        else:
+            self._finish(report=report)
+
+    def _conversion_progress(self, done, total, stage):
+        self.update_progress(done=done, total=total, stage=stage)
+
+
+def start_conversion(pdf_path, output_path=None, **kwargs):
+    """Start convert_scanned_pdf_to_ocr(pdf_path, output_path, **kwargs) in the background
+    and return its ConversionJob."""
+    job = ConversionJob(pdf_path, output_path or pdf_path)
+    threading.Thread(target=job._run, args=(kwargs,), name=f"convert {pdf_path}", daemon=True).start()
+    return job
+
+async def convert_scanned_pdf_to_ocr_async(pdf_path, output_path=None, **kwargs):
+    """Awaitable convert_scanned_pdf_to_ocr; cancelling the awaiting task cancels the job."""
+    job = start_conversion(pdf_path, output_path, **kwargs)
+    try:
+        return await job.wait_async()
+    except asyncio.CancelledError:
+        job.cancel()
+        raise
@@ -0,0 +1,116 @@
+import os
+import json
+import sqlite3
+import logging
+from ocr_cache import _decode, _encode
+
+LOGGER = logging.getLogger(__name__)
+
+# Journals live next to the output file they belong to
+JOURNAL_SUFFIX = ".journal.sqlite"
+
+
+class ConversionJournal:
+    """Checkpoint journal of finished pages for one conversion job.
+
+    Every completed page's OCR result is committed as soon as it is known, so a killed
+    conversion can be restarted and only redo the pages that never finished. The job
+    description (source, fingerprint, options) is stored with it; a journal written for
+    a different source or different settings is discarded rather than resumed.
+
+    Results are stored as data, never code, in the OCR cache's entry format: a JSON
+    header with the page's Tesseract PDF, if any, as raw bytes after it. A row that does
+    not decode counts as a page that is not done yet.
+    """
+
+    def __init__(self, output_path, job):
+        self.path = output_path + JOURNAL_SUFFIX
+        # Opened by whoever queues the job, written by the thread that assembles it; only
+        # one thread uses it at a time
+        self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pages (page_num INTEGER PRIMARY KEY, result BLOB)")
+        job = json.dumps(job, sort_keys=True, default=str)
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'job'").fetchone()
+        with self.connection:
+            if row is None or row[0] != job:
+                if row is not None:
+                    LOGGER.info(f"Discarding journal for a different job: {self.path}")
+                self.connection.execute("DELETE FROM pages")
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('job', ?)", (job,))
+        self.completed = set()
+        unreadable = []
+        for page_num, data in self.connection.execute("SELECT page_num, result FROM pages"):
+            try:
+                _unpack(data)
+            except (ValueError, KeyError, TypeError):
+                unreadable.append(page_num)
+                continue
+            self.completed.add(page_num)
+        if unreadable:
+            LOGGER.warning(f"Redoing {len(unreadable)} pages with unreadable journal entries: {self.path}")
+            with self.connection:
+                self.connection.executemany("DELETE FROM pages WHERE page_num = ?", [(page_num,) for page_num in unreadable])
+        if self.completed:
+            LOGGER.info(f"Resuming from journal: {len(self.completed)} pages already done")
+
+    def load(self, page_num):
+        row = self.connection.execute("SELECT result FROM pages WHERE page_num = ?", (page_num,)).fetchone()
+        return _unpack(row[0])
+
+    def record(self, page_num, result):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?)", (page_num, _pack(result)))
+        self.completed.add(page_num)
+
+    def close(self):
+        self.connection.close()
+
+    def finish(self):
+        """The job is done: close the journal and remove it with its WAL files."""
+        self.close()
+        for path in (self.path, self.path + "-wal", self.path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _pack(result):
+    """Encode a page result, keeping its Tesseract PDF as raw bytes."""
+    if "pdf" in result:
+        return _encode((result["pdf"], {key: value for key, value in result.items() if key != "pdf"}))
+    return _encode(result)
+
+def _unpack(data):
+    """Inverse of _pack; raises ValueError, KeyError or TypeError on a malformed row."""
+    value = _decode(bytes(data))
+    if isinstance(value, tuple):
+        pdf, result = value
+        return dict(result, pdf=pdf)
+    if not isinstance(value, dict):
+        raise TypeError(f"journal entry is a {type(value).__name__}, not a page result")
+    return value
+
+
+def pending_journals(directory):
+    """Return (source_path, output_path) for every unfinished conversion in directory."""
+    pending = []
+    if not os.path.isdir(directory):
+        return pending
+    for file in os.listdir(directory):
+        if not file.endswith(JOURNAL_SUFFIX):
+            continue
+        path = os.path.join(directory, file)
+        try:
+            connection = sqlite3.connect(path, timeout=30)
+            try:
+                row = connection.execute("SELECT value FROM meta WHERE key = 'job'").fetchone()
+            finally:
+                connection.close()
+            source_path = json.loads(row[0])["source"]
+        except (sqlite3.Error, TypeError, KeyError, ValueError) as e:
+            LOGGER.warning(f"Unreadable conversion journal {path} - {e}")
+            continue
+        pending.append((source_path, path[:-len(JOURNAL_SUFFIX)]))
+    return pending
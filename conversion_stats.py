@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import contextlib
+import collections
+import threading
+
+# Prometheus textfiles hold running totals, so every sink path keeps its own totals for
+# the life of the process
+_prometheus_totals = {}
+_prometheus_lock = threading.Lock()
+
+
+class ConversionStats:
+    """Stage timers and counters for a conversion.
+
+    time(stage) times a block under a stage name ("open", "classify", "render", "ocr",
+    "parse", "write", ...) and count(name, value) bumps a counter (pages, bytes, cache
+    hits). A stage timed inside another is booked to the inner stage only, so stage
+    seconds add up to the time measured. Stats gathered in worker threads or processes
+    travel back as plain dicts from as_dict() and are folded into the conversion's stats
+    with merge(). Each instance is meant for one thread.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.Counter()
+        self.counters = collections.Counter()
+        self._nested = []  # seconds spent in inner stages, per open stage
+
+    @contextlib.contextmanager
+    def time(self, stage):
+        started = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.seconds[stage] += elapsed - self._nested.pop()
+            self.calls[stage] += 1
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def merge(self, stats):
+        """Add a dict from another ConversionStats' as_dict() to these stats."""
+        if not stats:
+            return
+        for stage, entry in stats["stages"].items():
+            self.seconds[stage] += entry["seconds"]
+            self.calls[stage] += entry["calls"]
+        self.counters.update(stats["counters"])
+
+    def as_dict(self):
+        return {
+            "stages": {stage: {"seconds": round(seconds, 6), "calls": self.calls[stage]}
+                       for stage, seconds in self.seconds.items()},
+            "counters": dict(self.counters),
+        }
+
+
+class NullStats:
+    """Stand-in for ConversionStats when stats are off; every call is a no-op."""
+
+    enabled = False
+
+    def time(self, stage):
+        return _NULL_TIMER
+
+    def count(self, name, value=1):
+        pass
+
+    def merge(self, stats):
+        pass
+
+    def as_dict(self):
+        return None
+
+
+_NULL_TIMER = contextlib.nullcontext()
+NULL_STATS = NullStats()
+
+
+def _prometheus_name(name):
+    return "".join(char if char.isalnum() else "_" for char in name)
+
+def write_prometheus(path, stats):
+    """Add stats to the running totals for path and rewrite it as a Prometheus textfile."""
+    with _prometheus_lock:
+        totals = _prometheus_totals.setdefault(os.path.abspath(path), ConversionStats())
+        totals.merge(stats)
+        totals.count("conversions")
+        stages = sorted(totals.seconds)
+        lines = ["# TYPE ocr_stage_seconds_total counter"]
+        lines += [f'ocr_stage_seconds_total{{stage="{stage}"}} {totals.seconds[stage]:.6f}' for stage in stages]
+        lines.append("# TYPE ocr_stage_calls_total counter")
+        lines += [f'ocr_stage_calls_total{{stage="{stage}"}} {totals.calls[stage]}' for stage in stages]
+        for name in sorted(totals.counters):
+            metric = f"ocr_{_prometheus_name(name)}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {totals.counters[name]}"]
+        # The textfile collector may read at any moment, so replace the file in one step
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, path)
+
+def write_stats(sink, stats, **labels):
+    """Send a conversion's stats (an as_dict() dict) to a sink file.
+
+    A path ending in ".prom" is kept as a Prometheus textfile of running totals for the
+    node exporter's textfile collector; anything else gets one JSON line per conversion
+    with the labels (document, output, ...) alongside the stats.
+    """
+    if not sink or not stats:
+        return
+    if sink.endswith(".prom"):
+        write_prometheus(sink, stats)
+        return
+    record = {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), **labels, **stats}
+    with open(sink, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
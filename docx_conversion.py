@@ -2,7 +2,12 @@ import docx2txt
 from PIL import Image
 import pytesseract
 from docx import Document
+from ocr_engine import get_engine
+from ocr_cache import DEFAULT_CACHE_DIR, get_cache
+from ocr_sidecars import open_sidecars, words_to_lines, words_to_text
+from source_files import open_source
 import os
+import tempfile
 
 # Path to Tesseract-OCR executable (Update if necessary)
 pytesseract.pytesseract.tesseract_cmd = r'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
@@ -11,7 +16,8 @@ pytesseract.pytesseract.tesseract_cmd = r'C:\\Program Files\\Tesseract-OCR\\tess
 def is_scanned_word(file_path):
     
     try:
-        doc = Document(file_path)
+        with open_source(file_path) as source:
+            doc = Document(source.open_stream())
         text = []
         for para in doc.paragraphs:
             if para.text.strip():  # Check if paragraph has any text
@@ -25,26 +31,53 @@ def is_scanned_word(file_path):
         return True  # Assuming it's scanned if we can't process it
 
 
-def convert_docx_to_searchable(docx_path, output_path):
+def convert_docx_to_searchable(docx_path, output_path, ocr_cache=DEFAULT_CACHE_DIR, sidecars=()):
+    """OCR the images of a DOCX into a new Word document with one paragraph per image.
+
+    sidecars lists text sidecars to write next to the output, one page per image (see
+    ocr_sidecars); hOCR and ALTO need word boxes, so then each image is recognised into
+    words and its paragraph is built from them.
+    """
     # Extract images from the DOCX file
-    temp_dir = "temp_images"
-    os.makedirs(temp_dir, exist_ok=True)
-    docx2txt.process(docx_path, temp_dir)
+    # A private directory per call, so conversions running side by side never mix images
+    temp_dir = tempfile.mkdtemp(prefix="temp_images_")
+    # Read through open_source, sharing the mapping with any use of the file still open
+    # in this process (see source_files)
+    with open_source(docx_path) as source:
+        docx2txt.process(source.open_stream(), temp_dir)
 
     # Create a new Word document for the searchable text
     doc = Document()
 
-    # Iterate through extracted images and perform OCR
+    # Iterate through extracted images and perform OCR, reusing cached text for images
+    # that have been recognised before (ocr_cache=None turns the cache off)
+    ocr_engine = get_engine()
+    cache = get_cache(ocr_cache)
+    sidecar_writer = open_sidecars(output_path, sidecars)
+    with_boxes = bool(set(sidecars) - {"txt"})
+    kind, recognise = ("words", ocr_engine.image_to_words) if with_boxes else ("text", ocr_engine.image_to_string)
+    image_num = 0
     for image_file in os.listdir(temp_dir):
         image_path = os.path.join(temp_dir, image_file)
         if image_file.endswith(('png', 'jpg', 'jpeg')):
             img = Image.open(image_path)
-            text = pytesseract.image_to_string(img)
+            if cache is not None:
+                output, _ = cache.get_or_compute(img, lambda: recognise(img), ocr_engine.name, kind=kind,
+                                                 lang=ocr_engine.lang, psm=ocr_engine.psm, dpi=img.info.get("dpi"))
+            else:
+                output = recognise(img)
+            text = words_to_text(output) if with_boxes else output
             doc.add_paragraph(text)
+            if sidecar_writer:
+                lines = words_to_lines(output) if with_boxes else [[{"text": line}] for line in text.splitlines()]
+                sidecar_writer.add_page(image_num, img.size, lines)
+            image_num += 1
 
     # Save the searchable Word document
     doc.save(output_path)
     print(f"Searchable Word document saved to {output_path}")
+    if sidecar_writer:
+        sidecar_writer.close()
 
     # Clean up temporary image files
     for image_file in os.listdir(temp_dir):
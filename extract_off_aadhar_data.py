@@ -1,5 +1,7 @@
 import re
 from PyPDF2 import PdfReader
+from ocr_sidecars import read_sidecar_text
+from source_files import open_source
 
 
 # Function to filter English text from the PDF content
@@ -10,17 +12,23 @@ def filter_english_text(text):
 
 # Function to extract text from PDF using PyPDF2
 def extract_text_from_pdf(pdf_path, password=None):
+    # A converted PDF's text sidecar already holds its text, no parsing needed
+    pages = read_sidecar_text(pdf_path)
+    if pages is not None:
+        return "".join(pages)
     try:
-        reader = PdfReader(pdf_path)
-
-        # Check if PDF is encrypted and decrypt it with the password
-        if reader.is_encrypted:
-            reader.decrypt(password)
-        
-        # Extract text from all pages
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text()
+        # pypdf reads the mapped file in place instead of loading a copy of it
+        with open_source(pdf_path) as source:
+            reader = PdfReader(source.open_stream())
+
+            # Check if PDF is encrypted and decrypt it with the password
+            if reader.is_encrypted:
+                reader.decrypt(password)
+
+            # Extract text from all pages
+            text = ""
+            for page in reader.pages:
+                text += page.extract_text()
 
         return text
     except Exception as e:
@@ -1,7 +1,8 @@
 import os
 import re
 from docx import Document
-import fitz  # PyMuPDF for PDF files
+from ocr_sidecars import read_sidecar_text
+from source_files import open_source
 
 # Caches for file content and normalized text
 file_cache = {}
@@ -11,30 +12,36 @@ def is_machine_readable(file_path):
     """Determine if the file is machine-readable by attempting to open and read it."""
     if file_path.lower().endswith('.pdf'):
         try:
-            doc = fitz.open(file_path)
-            doc.close()
+            with open_source(file_path) as source:
+                source.open_pdf().close()
             return True
         except:
             return False
     elif file_path.lower().endswith('.docx'):
         try:
-            doc = Document(file_path)
+            with open_source(file_path) as source:
+                Document(source.open_stream())
             return True
         except:
             return False
     return False
 
 def extract_text_from_pdf(file_path):
-    """Extract text from a PDF file using PyMuPDF."""
+    """Extract text from a PDF file using PyMuPDF, or from its text sidecar when the
+    conversion wrote one (see ocr_sidecars)."""
     if file_path in file_cache:
         return file_cache[file_path]
-    
+
+    pages = read_sidecar_text(file_path)
+    if pages is not None:
+        file_cache[file_path] = "\n".join(pages)
+        return file_cache[file_path]
+
     try:
-        doc = fitz.open(file_path)
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        doc.close()
+        with open_source(file_path) as source, source.open_pdf() as doc:
+            text = ""
+            for page in doc:
+                text += page.get_text()
         file_cache[file_path] = text
         return text
     except Exception as e:
@@ -42,12 +49,18 @@ def extract_text_from_pdf(file_path):
         return ""
 
 def extract_text_from_docx(file_path):
-    """Extract text from a DOCX file using python-docx."""
+    """Extract text from a DOCX file using python-docx, or from its text sidecar."""
     if file_path in file_cache:
         return file_cache[file_path]
-    
+
+    pages = read_sidecar_text(file_path)
+    if pages is not None:
+        file_cache[file_path] = "\n".join(pages)
+        return file_cache[file_path]
+
     try:
-        doc = Document(file_path)
+        with open_source(file_path) as source:
+            doc = Document(source.open_stream())
         text = ""
         for para in doc.paragraphs:
             text += para.text + "\n"
@@ -68,17 +81,24 @@ def search_files(search_term, directory):
     for root, dirs, files in os.walk(directory):
         for file in files:
             file_path = os.path.join(root, file)
-            if not is_machine_readable(file_path):
+            if not file.lower().endswith(('.pdf', '.docx')):
                 continue
-
-            # Extract text based on file type
-            if file.lower().endswith('.pdf'):
-                text = extract_text_from_pdf(file_path)
-            elif file.lower().endswith('.docx'):
-                text = extract_text_from_docx(file_path)
-            else:
+            try:
+                source = open_source(file_path)
+            except OSError:
                 continue
 
+            # The readability check and the text extraction share one mapping of the file
+            with source:
+                if not is_machine_readable(file_path):
+                    continue
+
+                # Extract text based on file type
+                if file.lower().endswith('.pdf'):
+                    text = extract_text_from_pdf(file_path)
+                else:
+                    text = extract_text_from_docx(file_path)
+
             # Use text cache to avoid redundant normalization
             if file_path not in text_cache:
                 normalized_text = normalize_text(text)
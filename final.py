@@ -1,10 +1,9 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import threading
 import os
-from pdf_conversion import convert_scanned_pdf_to_ocr
+from batch_convert import PageScheduler
+from conversion_journal import pending_journals
 from file_searching import search_files
-from docx_conversion import convert_docx_to_searchable
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import logging
@@ -31,6 +30,7 @@ class UnifiedDocumentApp(tk.Tk):
         self.monitor_directory = tk.StringVar()
         self.observer = None
         self.file_records = set()  # Track known files
+        self.jobs = []  # Conversions queued or running, for the progress bar and Cancel
 
         # Style configuration
         self.style = ttk.Style()
@@ -93,7 +93,10 @@ class UnifiedDocumentApp(tk.Tk):
         self.status_label = ttk.Label(self, text="Status: Waiting for action...")
         self.status_label.pack(side=tk.LEFT, padx=10, pady=10, fill=tk.X)
 
-        self.progress_bar = ttk.Progressbar(self, mode='indeterminate')
+        cancel_button = ttk.Button(self, text="Cancel", command=self.cancel_conversions)
+        cancel_button.pack(side=tk.RIGHT, padx=10, pady=10)
+
+        self.progress_bar = ttk.Progressbar(self, mode='determinate', maximum=100)
         self.progress_bar.pack(side=tk.RIGHT, padx=10, pady=10)
 
         # Folder to store converted files
@@ -104,6 +107,14 @@ class UnifiedDocumentApp(tk.Tk):
         # Refresh the file list on startup
         self.refresh_file_list()
 
+        # Every conversion shares one fixed-size worker pool, however many files are queued
+        # Text sidecars let searches skip re-parsing the converted PDFs
+        self.scheduler = PageScheduler(journal=True, auto_rotate=True, sidecars=("txt",))
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        # Pick up conversions that were interrupted last time
+        self.resume_interrupted_conversions()
+
     def select_documents(self):
         file_paths = filedialog.askopenfilenames(
             filetypes=[("Document files", "*.pdf *.docx")],
@@ -120,7 +131,6 @@ class UnifiedDocumentApp(tk.Tk):
             return
 
         self.status_label.config(text="Status: Converting...")
-        self.progress_bar.start()
 
         for doc_path in doc_paths:
             if not os.path.exists(doc_path):
@@ -129,36 +139,103 @@ class UnifiedDocumentApp(tk.Tk):
 
             if doc_path.lower().endswith(".pdf"):
                 output_path = os.path.join(self.converted_folder, os.path.basename(doc_path).replace(".pdf", "_converted.pdf"))
-                threading.Thread(target=self.convert_pdf, args=(doc_path, output_path)).start()
+                self.convert_pdf(doc_path, output_path)
             elif doc_path.lower().endswith(".docx"):
                 output_path = os.path.join(self.converted_folder, os.path.basename(doc_path).replace(".docx", "_searchable.docx"))
-                threading.Thread(target=self.convert_docx, args=(doc_path, output_path)).start()
+                self.convert_docx(doc_path, output_path)
 
-    def convert_pdf(self, doc_path, output_path):
+    def resume_interrupted_conversions(self):
+        """Restart every PDF conversion that left a journal behind in the converted folder."""
+        for doc_path, output_path in pending_journals(self.converted_folder):
+            if not os.path.exists(doc_path):
+                LOGGER.warning(f"Cannot resume conversion, source is gone: {doc_path}")
+                continue
+            LOGGER.info(f"Resuming interrupted conversion: {doc_path}")
+            self.convert_pdf(doc_path, output_path)
+
+    def submit_conversion(self, doc_path, output_path, on_done):
+        """Queue a document on the shared scheduler; on_done(job) runs when it finishes.
+
+        Job callbacks fire in the scheduler's thread, so they are handed to the Tk event
+        loop with after() before touching any widget. A document whose output is already
+        being produced by a queued or running job is not queued again.
+        """
+        if any(os.path.abspath(job.output_path) == os.path.abspath(output_path) for job in self.jobs):
+            LOGGER.info(f"Already converting to {output_path}, not queueing {doc_path} again")
+            return
         try:
-            LOGGER.info(f"Converting PDF: {doc_path} to {output_path}")
-            convert_scanned_pdf_to_ocr(doc_path, output_path)
-            LOGGER.info(f"PDF Conversion completed: {output_path}")
-            self.status_label.config(text=f"Status: Conversion completed for {doc_path}")
+            job = self.scheduler.submit(doc_path, output_path)
         except Exception as e:
-            LOGGER.error(f"Error during PDF conversion: {str(e)}")
+            LOGGER.error(f"Error during conversion: {str(e)}")
             self.status_label.config(text=f"Status: Error - {str(e)}")
-        finally:
-            self.progress_bar.stop()
-            self.refresh_file_list()  # Refresh the file list after conversion
+            return
+        self.jobs.append(job)
+        self.update_progress()
+        job.add_progress_callback(lambda progress: self.after(0, self.update_progress))
+        job.add_done_callback(lambda job: self.after(0, self.conversion_finished, job, on_done))
+
+    def conversion_finished(self, job, on_done):
+        self.jobs.remove(job)
+        on_done(job)
+        self.update_progress()
+
+    def update_progress(self):
+        """Show the pages done across all running conversions, with the longest ETA."""
+        progress = [job.progress() for job in self.jobs]
+        total = sum(entry["total"] or 0 for entry in progress)
+        done = sum(entry["done"] for entry in progress)
+        self.progress_bar["value"] = 100 * done / total if total else 0
+        if not self.jobs:
+            return
+        etas = [entry["eta"] for entry in progress if entry["eta"] is not None]
+        eta = f", about {int(max(etas))}s left" if etas else ""
+        self.status_label.config(text=f"Status: Converting {len(self.jobs)} document(s): {done}/{total} pages{eta}")
+
+    def cancel_conversions(self):
+        """Cancel every queued and running conversion."""
+        if not self.jobs:
+            return
+        for job in list(self.jobs):
+            job.cancel()
+        self.status_label.config(text="Status: Cancelling...")
+
+    def convert_pdf(self, doc_path, output_path):
+        LOGGER.info(f"Converting PDF: {doc_path} to {output_path}")
+        self.submit_conversion(doc_path, output_path, self.pdf_converted)
+
+    def pdf_converted(self, job):
+        if job.cancelled:
+            LOGGER.info(f"PDF conversion cancelled: {job.path}")
+            self.status_label.config(text=f"Status: Conversion cancelled for {job.path}")
+        elif job.error:
+            LOGGER.error(f"Error during PDF conversion: {str(job.error)}")
+            self.status_label.config(text=f"Status: Error - {str(job.error)}")
+        else:
+            LOGGER.info(f"PDF Conversion completed: {job.output_path}")
+            self.status_label.config(text=f"Status: Conversion completed for {job.path}")
+        self.refresh_file_list()  # Refresh the file list after conversion
 
     def convert_docx(self, doc_path, output_path):
-        try:
-            LOGGER.info(f"Converting DOCX: {doc_path} to {output_path}")
-            convert_docx_to_searchable(doc_path, output_path)
-            LOGGER.info(f"DOCX Conversion completed: {output_path}")
-            self.status_label.config(text=f"Searchable DOCX saved as: {output_path}")
-        except Exception as e:
-            LOGGER.error(f"Error during DOCX conversion: {str(e)}")
-            self.status_label.config(text=f"Status: Error - {str(e)}")
-        finally:
-            self.progress_bar.stop()
-            self.refresh_file_list()  # Refresh the file list after conversion
+        LOGGER.info(f"Converting DOCX: {doc_path} to {output_path}")
+        self.submit_conversion(doc_path, output_path, self.docx_converted)
+
+    def docx_converted(self, job):
+        if job.cancelled:
+            LOGGER.info(f"DOCX conversion cancelled: {job.path}")
+            self.status_label.config(text=f"Status: Conversion cancelled for {job.path}")
+        elif job.error:
+            LOGGER.error(f"Error during DOCX conversion: {str(job.error)}")
+            self.status_label.config(text=f"Status: Error - {str(job.error)}")
+        else:
+            LOGGER.info(f"DOCX Conversion completed: {job.output_path}")
+            self.status_label.config(text=f"Searchable DOCX saved as: {job.output_path}")
+        self.refresh_file_list()  # Refresh the file list after conversion
+
+    def on_close(self):
+        """Stop the worker pool without waiting; journals let unfinished PDFs resume."""
+        self.stop_monitoring()
+        self.scheduler.close(wait=False)
+        self.destroy()
 
     def search_files(self):
         search_term = self.search_var.get()
@@ -240,12 +317,19 @@ class UnifiedDocumentApp(tk.Tk):
                 # Start conversion for new files
                 if file.lower().endswith(".pdf"):
                     output_path = os.path.join(self.converted_folder, file.replace(".pdf", "_converted.pdf"))
-                    threading.Thread(target=self.convert_pdf, args=(os.path.join(directory, file), output_path)).start()
+                    self.convert_pdf(os.path.join(directory, file), output_path)
                 elif file.lower().endswith(".docx"):
                     output_path = os.path.join(self.converted_folder, file.replace(".docx", "_searchable.docx"))
-                    threading.Thread(target=self.convert_docx, args=(os.path.join(directory, file), output_path)).start()
+                    self.convert_docx(os.path.join(directory, file), output_path)
 
 class FileHandler(FileSystemEventHandler):
+    """Queue conversions for documents created in the monitored directory.
+
+    Watchdog calls on_created from its observer thread, so the work is handed to the Tk
+    event loop with after(); submit_conversion drops the second submission when the
+    file list update and process_pdf/process_docx both queue the same file.
+    """
+
     def __init__(self, app):
         self.app = app
 
@@ -254,37 +338,25 @@ class FileHandler(FileSystemEventHandler):
             LOGGER.info(f"File created: {event.src_path}")
             
             # Call the method to update the file list
-            self.app.update_file_list()
+            self.app.after(0, self.app.update_file_list)
 
             # Process newly created files
             if event.src_path.lower().endswith(".pdf"):
-                self.process_pdf(event.src_path)
+                self.app.after(0, self.process_pdf, event.src_path)
             elif event.src_path.lower().endswith(".docx"):
-                self.process_docx(event.src_path)
+                self.app.after(0, self.process_docx, event.src_path)
 
     def process_pdf(self, pdf_path):
         """Convert the newly created PDF file."""
-        try:
-            output_path = os.path.join(self.app.converted_folder, os.path.basename(pdf_path).replace(".pdf", "_converted.pdf"))
-            LOGGER.info(f"Converting PDF: {pdf_path} to {output_path}")
-            convert_scanned_pdf_to_ocr(pdf_path, output_path)
-            LOGGER.info(f"PDF Conversion completed: {output_path}")
-            self.app.refresh_file_list()
-        except Exception as e:
-            LOGGER.error(f"Error during PDF conversion: {str(e)}")
+        output_path = os.path.join(self.app.converted_folder, os.path.basename(pdf_path).replace(".pdf", "_converted.pdf"))
+        self.app.convert_pdf(pdf_path, output_path)
         
 
 
     def process_docx(self, docx_path):
         """Convert the newly created DOCX file."""
-        try:
-            output_path = os.path.join(self.app.converted_folder, os.path.basename(docx_path).replace(".docx", "_searchable.docx"))
-            LOGGER.info(f"Converting DOCX: {docx_path} to {output_path}")
-            convert_docx_to_searchable(docx_path, output_path)
-            LOGGER.info(f"DOCX Conversion completed: {output_path}")
-            self.app.refresh_file_list()
-        except Exception as e:
-            LOGGER.error(f"Error during DOCX conversion: {str(e)}")
+        output_path = os.path.join(self.app.converted_folder, os.path.basename(docx_path).replace(".docx", "_searchable.docx"))
+        self.app.convert_docx(docx_path, output_path)
         
 
         
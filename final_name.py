@@ -1,16 +1,18 @@
 import json
-import fitz  # PyMuPDF
 import pytesseract
 from PIL import Image
 import io
 import re
+from ocr_engine import get_engine
+from ocr_sidecars import read_sidecar_text
+from source_files import open_source
 
 # Configure Tesseract executable path
 pytesseract.pytesseract.tesseract_cmd = r"C:\\Program Files\\Tesseract-OCR\\tesseract.exe"
 
-# Function to extract text from image using pytesseract
+# Function to extract text from image using the shared OCR engine
 def extract_text_from_image(image):
-    return pytesseract.image_to_string(image)
+    return get_engine().image_to_string(image)
 
 # Function to filter English text from the OCR text
 def filter_english_text(text):
@@ -100,31 +102,35 @@ def extract_aadhaar_details(text):
 
 # Function to extract data from scanned PDF
 def extract_data_from_pdf(pdf_path):
-    # Open the PDF file
-    doc = fitz.open(pdf_path)
-    
-    full_text = ""
-    
-    # Iterate through pages
-    for page_number in range(len(doc)):
-        page = doc.load_page(page_number)
-        images = page.get_images(full=True)
-        
-        # If images found on the page
-        for img_index, img in enumerate(images):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            image_ext = base_image["ext"]
-            
-            # Convert the image to PIL format
-            image = Image.open(io.BytesIO(image_bytes))
-            
-            # Apply OCR to extract text
-            text = extract_text_from_image(image)
-            
-            full_text += text  # Collect text from all pages
-    
+    # A converted PDF with a text sidecar has been OCRed already
+    pages = read_sidecar_text(pdf_path)
+    if pages is not None:
+        return extract_aadhaar_details("".join(pages))
+
+    # Open the PDF file from the shared mapping (see source_files)
+    with open_source(pdf_path) as source, source.open_pdf() as doc:
+        full_text = ""
+
+        # Iterate through pages
+        for page_number in range(len(doc)):
+            page = doc.load_page(page_number)
+            images = page.get_images(full=True)
+
+            # If images found on the page
+            for img_index, img in enumerate(images):
+                xref = img[0]
+                base_image = doc.extract_image(xref)
+                image_bytes = base_image["image"]
+                image_ext = base_image["ext"]
+
+                # Convert the image to PIL format
+                image = Image.open(io.BytesIO(image_bytes))
+
+                # Apply OCR to extract text
+                text = extract_text_from_image(image)
+
+                full_text += text  # Collect text from all pages
+
     # Extract the details from the full OCR text
     details = extract_aadhaar_details(full_text)
     
@@ -0,0 +1,179 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+# The user's own cache directory, home of the default on-disk caches, so other users
+# cannot plant entries in them and they do not depend on the working directory
+USER_CACHE_DIR = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+
+# Default location and size budget of the on-disk OCR cache
+DEFAULT_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", os.path.join(USER_CACHE_DIR, "ocr"))
+DEFAULT_MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES", 2 << 30))
+
+# Eviction trims the cache down to this share of max_bytes so it does not run on every put
+EVICT_TO = 0.9
+
+# Bumped whenever the entry format changes so entries in an older format are never read
+FORMAT_VERSION = 2
+
+# One cache object per directory per process
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class OcrCache:
+    """Content-addressed on-disk cache of OCR output with size-bounded LRU eviction.
+
+    Keys are a hash of the image pixels plus the OCR engine and config, so the same page
+    image OCRed with the same settings is only ever recognised once. Entries are single
+    files whose mtime is bumped on every hit; eviction removes the least recently used
+    ones.
+
+    Entries hold data only, never code: a JSON header line followed by the raw bytes of
+    the PDF page, if the output has one. Values are therefore limited to PDF bytes, JSON
+    data (words, text, OSD answers) and (PDF bytes, JSON data) pairs. An entry that does
+    not decode is a miss.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = None
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    def key(self, img, engine, **config):
+        """Hash the image's mode, size and pixels together with the OCR engine name and config."""
+        digest = hashlib.sha256()
+        config = dict(config, engine=engine, format=FORMAT_VERSION)
+        digest.update(json.dumps(config, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(f"{img.mode}:{img.width}x{img.height}".encode("utf-8"))
+        digest.update(img.tobytes())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = _decode(f.read())
+            os.utime(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        try:
+            data = _encode(value)
+        except (TypeError, ValueError) as e:
+            LOGGER.warning(f"Cannot cache OCR output {key} - {e}")
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # Write to a temp file first so readers in other workers never see half an entry
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            LOGGER.warning(f"Failed to write OCR cache entry {key} - {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def get_or_compute(self, img, compute, engine, **config):
+        """Return (output, hit) for img, engine and config, running compute() on a miss."""
+        key = self.key(img, engine, **config)
+        value = self.get(key)
+        if value is not None:
+            return value, True
+        value = compute()
+        self.put(key, value)
+        return value, False
+
+    def _entries(self):
+        for root, dirs, files in os.walk(self.directory):
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _disk_usage(self):
+        return sum(size for mtime, size, path in self._entries())
+
+    def _evict(self):
+        """Remove least recently used entries until the cache is back under budget."""
+        entries = sorted(self._entries())
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def _encode(value):
+    """Serialise an OCR output as a JSON header line plus its raw PDF bytes, if any."""
+    if isinstance(value, bytes):
+        header, pdf = {"shape": "pdf"}, value
+    elif isinstance(value, tuple) and len(value) == 2 and isinstance(value[0], bytes):
+        header, pdf = {"shape": "pdf+json", "value": value[1]}, value[0]
+    else:
+        header, pdf = {"shape": "json", "value": value}, b""
+    header["pdf_bytes"] = len(pdf)
+    return json.dumps(header, allow_nan=False).encode("utf-8") + b"\n" + pdf
+
+def _decode(data):
+    """Inverse of _encode; raises ValueError, KeyError or TypeError on a malformed entry."""
+    header_line, _, pdf = data.partition(b"\n")
+    header = json.loads(header_line)
+    if len(pdf) != header["pdf_bytes"]:
+        raise ValueError("truncated entry")
+    if header["shape"] == "pdf":
+        return pdf
+    if header["shape"] == "pdf+json":
+        return pdf, header["value"]
+    if header["shape"] == "json":
+        return header["value"]
+    raise ValueError(f"unknown entry shape {header['shape']!r}")
+
+
+def get_cache(directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """Return this process's cache for directory, or None when directory is None."""
+    if directory is None:
+        return None
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = OcrCache(directory, max_bytes)
+        return _caches[directory]
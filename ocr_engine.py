@@ -0,0 +1,225 @@
+import os
+import tempfile
+import threading
+import logging
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:  # tesserocr is optional; pytesseract is always available
+    tesserocr = None
+
+LOGGER = logging.getLogger(__name__)
+pytesseract.pytesseract.tesseract_cmd = r"C:\\Program Files\\Tesseract-OCR\\tesseract.exe"
+
+# "auto" uses the resident tesserocr engine when it is installed, else pytesseract
+DEFAULT_ENGINE = os.environ.get("OCR_ENGINE", "auto")
+
+# One engine per (thread, engine, lang, psm, timeout); a thread-local is also per-process, so every
+# pool worker loads its models exactly once
+_local = threading.local()
+
+
+def tsv_to_words(tsv):
+    """Parse Tesseract's TSV output into the word dicts returned by image_to_words."""
+    words = []
+    lines = tsv.splitlines()
+    header = lines[0].split("\t") if lines else []
+    for line in lines[1:]:
+        row = dict(zip(header, line.split("\t")))
+        text = row.get("text", "")
+        if text.strip():
+            words.append({
+                "text": text,
+                "left": int(row["left"]),
+                "top": int(row["top"]),
+                "width": int(row["width"]),
+                "height": int(row["height"]),
+                "conf": float(row["conf"]),
+            })
+    return words
+
+
+class PytesseractEngine:
+    """Fallback engine: runs the tesseract executable once per call.
+
+    Every engine offers image_to_string, image_to_hocr, image_to_pdf and image_to_words;
+    the latter returns one dict per word with its pixel box (left, top, width, height),
+    text and confidence. image_to_pdf_and_words returns both from a single recognition.
+    osd runs orientation and script detection and returns the clockwise "rotate" in
+    degrees that makes the page upright, its "confidence" and the "script". A non-zero
+    timeout (seconds) makes a recognition that runs longer raise instead of hanging.
+    """
+
+    name = "pytesseract"
+
+    def __init__(self, lang="eng", psm=3, timeout=0):
+        self.lang = lang
+        self.psm = psm
+        self.timeout = timeout
+        self.config = f"--psm {psm}"
+
+    def image_to_string(self, img):
+        return pytesseract.image_to_string(img, lang=self.lang, config=self.config, timeout=self.timeout)
+
+    def image_to_hocr(self, img):
+        return pytesseract.image_to_pdf_or_hocr(img, extension='hocr', lang=self.lang, config=self.config,
+                                                timeout=self.timeout)
+
+    def image_to_pdf(self, img):
+        return pytesseract.image_to_pdf_or_hocr(img, extension='pdf', lang=self.lang, config=self.config,
+                                                timeout=self.timeout)
+
+    def image_to_words(self, img):
+        data = pytesseract.image_to_data(img, lang=self.lang, config=self.config, output_type=pytesseract.Output.DICT,
+                                         timeout=self.timeout)
+        words = []
+        for i, text in enumerate(data["text"]):
+            if text.strip():
+                words.append({
+                    "text": text,
+                    "left": data["left"][i],
+                    "top": data["top"][i],
+                    "width": data["width"][i],
+                    "height": data["height"][i],
+                    "conf": float(data["conf"][i]),
+                })
+        return words
+
+    def osd(self, img):
+        osd = pytesseract.image_to_osd(img, output_type=pytesseract.Output.DICT, timeout=self.timeout)
+        return {"rotate": int(osd["rotate"]), "confidence": float(osd["orientation_conf"]), "script": osd["script"]}
+
+    def image_to_pdf_and_words(self, img):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            image_path = os.path.join(temp_dir, "page.png")
+            img.save(image_path)
+            output_base = os.path.join(temp_dir, "page")
+            # One tesseract run writes page.pdf and, through the tsv config, page.tsv
+            pytesseract.pytesseract.run_tesseract(image_path, output_base, extension="pdf", lang=self.lang,
+                                                  config=f"{self.config} -c tessedit_create_tsv=1", timeout=self.timeout)
+            with open(output_base + ".pdf", "rb") as f:
+                pdf = f.read()
+            with open(output_base + ".tsv", encoding="utf-8") as f:
+                return pdf, tsv_to_words(f.read())
+
+
+class TesserocrEngine:
+    """Resident engine: keeps one Tesseract API handle, with its models loaded, per worker."""
+
+    name = "tesserocr"
+
+    def __init__(self, lang="eng", psm=3, timeout=0):
+        self.lang = lang
+        self.psm = psm
+        self.timeout = timeout
+        kwargs = {"lang": lang, "psm": psm}
+        if os.environ.get("TESSDATA_PREFIX"):
+            kwargs["path"] = os.environ["TESSDATA_PREFIX"]
+        self.api = tesserocr.PyTessBaseAPI(**kwargs)
+
+    def _set_image(self, img):
+        # Hand Tesseract the raw pixel buffer instead of letting it re-encode the image
+        if img.mode not in ("L", "RGB"):
+            img = img.convert("RGB")
+        bytes_per_pixel = len(img.getbands())
+        self.api.SetImageBytes(img.tobytes(), img.width, img.height, bytes_per_pixel, img.width * bytes_per_pixel)
+        dpi = img.info.get("dpi")
+        if dpi:
+            self.api.SetSourceResolution(int(dpi[0]))
+
+    def _recognize(self):
+        if not self.api.Recognize(int(self.timeout * 1000)):
+            raise RuntimeError("tesserocr recognition failed or timed out")
+
+    def image_to_string(self, img):
+        self._set_image(img)
+        self._recognize()
+        return self.api.GetUTF8Text()
+
+    def image_to_hocr(self, img):
+        self._set_image(img)
+        self._recognize()
+        return self.api.GetHOCRText(0).encode("utf-8")
+
+    def image_to_words(self, img):
+        self._set_image(img)
+        self._recognize()
+        words = []
+        level = tesserocr.RIL.WORD
+        for word in tesserocr.iterate_level(self.api.GetIterator(), level):
+            text = word.GetUTF8Text(level)
+            if text and text.strip():
+                left, top, right, bottom = word.BoundingBox(level)
+                words.append({
+                    "text": text,
+                    "left": left,
+                    "top": top,
+                    "width": right - left,
+                    "height": bottom - top,
+                    "conf": word.Confidence(level),
+                })
+        return words
+
+    def osd(self, img):
+        self._set_image(img)
+        osd = self.api.DetectOrientationScript()
+        if not osd:
+            raise RuntimeError("tesserocr could not detect the page orientation")
+        # orient_deg is how far the page is turned counter-clockwise
+        return {"rotate": (360 - osd["orient_deg"]) % 360, "confidence": osd["orient_conf"], "script": osd["script_name"]}
+
+    def _process_page(self, img, renderers):
+        # The PDF renderer embeds the source image from disk, so it still needs one temp
+        # file, but no process start-up and no traineddata reload
+        outputs = {}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            image_path = os.path.join(temp_dir, "page.png")
+            img.save(image_path)
+            output_base = os.path.join(temp_dir, "page")
+            for renderer in renderers:
+                self.api.SetVariable(f"tessedit_create_{renderer}", "1")
+            try:
+                if not self.api.ProcessPage(output_base, img, 0, image_path, timeout=int(self.timeout * 1000)):
+                    raise RuntimeError("tesserocr failed to process the page or timed out")
+            finally:
+                for renderer in renderers:
+                    self.api.SetVariable(f"tessedit_create_{renderer}", "0")
+            for renderer in renderers:
+                with open(f"{output_base}.{renderer}", "rb") as f:
+                    outputs[renderer] = f.read()
+        return outputs
+
+    def image_to_pdf(self, img):
+        return self._process_page(img, ("pdf",))["pdf"]
+
+    def image_to_pdf_and_words(self, img):
+        outputs = self._process_page(img, ("pdf", "tsv"))
+        return outputs["pdf"], tsv_to_words(outputs["tsv"].decode("utf-8"))
+
+
+def get_engine(lang="eng", psm=3, engine=None, timeout=0):
+    """Return this worker's OCR engine, creating it (and loading models) on first use.
+
+    timeout is the longest, in seconds, a single recognition may take (0 for no limit).
+    """
+    engine = engine or DEFAULT_ENGINE
+    if engine == "auto":
+        engine = "tesserocr" if tesserocr is not None else "pytesseract"
+    if engine not in ("tesserocr", "pytesseract"):
+        raise ValueError(f"Unknown OCR engine: {engine}")
+
+    engines = getattr(_local, "engines", None)
+    if engines is None:
+        engines = _local.engines = {}
+    key = (engine, lang, psm, timeout)
+    if key not in engines:
+        if engine == "tesserocr":
+            try:
+                engines[key] = TesserocrEngine(lang, psm, timeout)
+            except Exception as e:
+                LOGGER.warning(f"tesserocr unavailable, falling back to pytesseract - {e}")
+                engines[key] = PytesseractEngine(lang, psm, timeout)
+        else:
+            engines[key] = PytesseractEngine(lang, psm, timeout)
+    return engines[key]
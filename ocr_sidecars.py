@@ -0,0 +1,189 @@
+import os
+import html
+
+# Sidecar formats and the suffix each adds to the output path, so a sidecar sits next to
+# its output the way the conversion journal does
+SIDECAR_SUFFIXES = {"txt": ".txt", "hocr": ".hocr", "alto": ".alto.xml"}
+SIDECAR_FORMATS = tuple(SIDECAR_SUFFIXES)
+
+# Pages are separated by a form feed in the plain text sidecar, as pdftotext does
+PAGE_BREAK = "\f"
+
+HOCR_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+<head>
+<title>{title}</title>
+<meta http-equiv="Content-Type" content="text/html;charset=utf-8"/>
+<meta name="ocr-system" content="tesseract"/>
+<meta name="ocr-capabilities" content="ocr_page ocr_line ocrx_word"/>
+</head>
+<body>
+"""
+HOCR_FOOTER = "</body>\n</html>\n"
+
+ALTO_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v4#" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:schemaLocation="http://www.loc.gov/standards/alto/ns-v4# http://www.loc.gov/alto/v4/alto-4-2.xsd">
+<Description>
+<MeasurementUnit>pixel</MeasurementUnit>
+<sourceImageInformation><fileName>{title}</fileName></sourceImageInformation>
+</Description>
+<Layout>
+"""
+ALTO_FOOTER = "</Layout>\n</alto>\n"
+
+
+def sidecar_path(output_path, fmt):
+    return output_path + SIDECAR_SUFFIXES[fmt]
+
+def words_to_lines(words):
+    """Group OCR words, which come in reading order, into lines: a word starts a new line
+    unless it sits to the right of the previous one and level with it."""
+    lines = []
+    for word in words:
+        if lines:
+            previous = lines[-1][-1]
+            middle = word["top"] + word["height"] / 2
+            if word["left"] >= previous["left"] and previous["top"] <= middle <= previous["top"] + previous["height"]:
+                lines[-1].append(word)
+                continue
+        lines.append([word])
+    return lines
+
+def words_to_text(words):
+    return "\n".join(" ".join(word["text"] for word in line) for line in words_to_lines(words))
+
+def text_layer_lines(page):
+    """The lines of words on a page's own text layer, with boxes in points."""
+    lines = {}
+    for x0, y0, x1, y1, text, block, line, _ in page.get_text("words"):
+        lines.setdefault((block, line), []).append({
+            "text": text, "left": round(x0), "top": round(y0),
+            "width": round(x1 - x0), "height": round(y1 - y0), "conf": None,
+        })
+    return list(lines.values())
+
+def page_lines(page_num, ocr_result, pdf_document):
+    """Return (width, height) and the lines of words of one converted page.
+
+    OCRed pages use the recognised words, in pixels of the (upright) page image; pages
+    copied through are read from the source document's text layer, in points.
+    """
+    if ocr_result and ocr_result["status"] == "ocr":
+        return ocr_result["size"], words_to_lines(ocr_result["words"])
+    page = pdf_document.load_page(page_num)
+    size = (round(page.rect.width), round(page.rect.height))
+    if ocr_result and ocr_result["status"] == "text":
+        return size, text_layer_lines(page)
+    return size, []
+
+def bounding_box(words):
+    left = min(word["left"] for word in words)
+    top = min(word["top"] for word in words)
+    right = max(word["left"] + word["width"] for word in words)
+    bottom = max(word["top"] + word["height"] for word in words)
+    return left, top, right, bottom
+
+def hocr_page(page_num, size, lines):
+    out = [f'<div class="ocr_page" id="page_{page_num + 1}" title="bbox 0 0 {size[0]} {size[1]}; ppageno {page_num}">']
+    for line_num, line in enumerate(lines, 1):
+        out.append(f' <span class="ocr_line" id="line_{page_num + 1}_{line_num}" title="bbox {" ".join(map(str, bounding_box(line)))}">')
+        for word_num, word in enumerate(line, 1):
+            title = f'bbox {word["left"]} {word["top"]} {word["left"] + word["width"]} {word["top"] + word["height"]}'
+            if word.get("conf") is not None:
+                title += f'; x_wconf {round(word["conf"])}'
+            out.append(f'  <span class="ocrx_word" id="word_{page_num + 1}_{line_num}_{word_num}" title="{title}">'
+                       f'{html.escape(word["text"], quote=False)}</span>')
+        out.append(" </span>")
+    out.append("</div>")
+    return "\n".join(out) + "\n"
+
+def alto_box(left, top, right, bottom):
+    return f'HPOS="{left}" VPOS="{top}" WIDTH="{right - left}" HEIGHT="{bottom - top}"'
+
+def alto_page(page_num, size, lines):
+    out = [f'<Page ID="page_{page_num}" PHYSICAL_IMG_NR="{page_num + 1}" WIDTH="{size[0]}" HEIGHT="{size[1]}">',
+           f'<PrintSpace {alto_box(0, 0, *size)}>']
+    if lines:
+        out.append(f'<TextBlock ID="block_{page_num}" {alto_box(*bounding_box([w for line in lines for w in line]))}>')
+        for line_num, line in enumerate(lines):
+            out.append(f'<TextLine ID="line_{page_num}_{line_num}" {alto_box(*bounding_box(line))}>')
+            strings = []
+            for word_num, word in enumerate(line):
+                box = alto_box(word["left"], word["top"], word["left"] + word["width"], word["top"] + word["height"])
+                confidence = f' WC="{max(0.0, word["conf"]) / 100:.2f}"' if word.get("conf") is not None else ""
+                strings.append(f'<String ID="word_{page_num}_{line_num}_{word_num}" '
+                               f'CONTENT="{html.escape(word["text"])}" {box}{confidence}/>')
+            out.append("<SP/>".join(strings))
+            out.append("</TextLine>")
+        out.append("</TextBlock>")
+    out.append("</PrintSpace>\n</Page>")
+    return "\n".join(out) + "\n"
+
+
+class SidecarWriter:
+    """Write plain text, hOCR and/or ALTO sidecars for an output, one page at a time.
+
+    Each sidecar is written to a ".part" file that replaces sidecar_path(output_path, fmt)
+    on close(). Call close() once the output itself is final, so a sidecar is never older
+    than its output; read_sidecar_text() ignores one that is.
+    """
+
+    def __init__(self, output_path, formats):
+        self.output_path = output_path
+        self.paths = {fmt: sidecar_path(output_path, fmt) for fmt in formats}
+        self.files = {fmt: open(path + ".part", "w", encoding="utf-8") for fmt, path in self.paths.items()}
+        self.pages = 0
+        title = html.escape(os.path.basename(output_path))
+        if "hocr" in self.files:
+            self.files["hocr"].write(HOCR_HEADER.format(title=title))
+        if "alto" in self.files:
+            self.files["alto"].write(ALTO_HEADER.format(title=title))
+
+    def add_page(self, page_num, size, lines):
+        if "txt" in self.files:
+            if self.pages:
+                self.files["txt"].write(PAGE_BREAK)
+            text = "\n".join(" ".join(word["text"] for word in line) for line in lines)
+            self.files["txt"].write(text.replace(PAGE_BREAK, ""))
+        if "hocr" in self.files:
+            self.files["hocr"].write(hocr_page(page_num, size, lines))
+        if "alto" in self.files:
+            self.files["alto"].write(alto_page(page_num, size, lines))
+        self.pages += 1
+
+    def add(self, page_num, ocr_result, pdf_document):
+        """Add a converted page; pdf_document is the source, read for pages not OCRed."""
+        self.add_page(page_num, *page_lines(page_num, ocr_result, pdf_document))
+
+    def close(self):
+        if "hocr" in self.files:
+            self.files["hocr"].write(HOCR_FOOTER)
+        if "alto" in self.files:
+            self.files["alto"].write(ALTO_FOOTER)
+        for fmt, f in self.files.items():
+            f.close()
+            os.replace(self.paths[fmt] + ".part", self.paths[fmt])
+        return dict(self.paths)
+
+    def abort(self):
+        for fmt, f in self.files.items():
+            f.close()
+            os.remove(self.paths[fmt] + ".part")
+
+
+def open_sidecars(output_path, formats):
+    """Return a SidecarWriter for formats, or None when no sidecars were asked for."""
+    return SidecarWriter(output_path, formats) if formats else None
+
+def read_sidecar_text(output_path):
+    """Return the pages of output_path's plain text sidecar, or None when it has none
+    that is at least as new as the output."""
+    path = sidecar_path(output_path, "txt")
+    try:
+        if os.path.getmtime(path) < os.path.getmtime(output_path):
+            return None  # left over from an earlier conversion
+        with open(path, encoding="utf-8") as f:
+            return f.read().split(PAGE_BREAK)
+    except OSError:
+        return None
@@ -0,0 +1,301 @@
+import os
+import time
+import itertools
+import queue
+import logging
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import fitz  # PyMuPDF
+from PIL import Image
+from pdf_conversion import (ConversionCancelled, failed_result, limit_worker_memory, ocr_image, page_image,
+                            skipped_result, stall_timeout, check_cancelled)
+from conversion_stats import NULL_STATS, ConversionStats
+
+LOGGER = logging.getLogger(__name__)
+
+# How often a stage blocked on a queue, and the assembler, look up to check for a stop
+POLL_SECONDS = 0.2
+
+# Rendered frames allowed to wait for the OCR stage, per OCR worker
+FRAMES_PER_OCR_WORKER = 2
+
+# Seconds stage processes get to wind down before they are terminated
+STOP_GRACE = 2
+
+# Value of a stage process's current page while it holds none
+IDLE = -1
+
+
+def write_frame(img):
+    """Copy a page image into a new shared memory block and return its frame descriptor.
+
+    The block outlives this process; whoever reads the frame unlinks it.
+    """
+    data = img.tobytes()
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    shm.buf[:len(data)] = data
+    frame = {"shm": shm.name, "mode": img.mode, "size": img.size, "length": len(data), "dpi": img.info.get("dpi")}
+    shm.close()
+    return frame
+
+def read_frame(frame):
+    """Rebuild the page image held by a frame and free its shared memory block."""
+    shm = shared_memory.SharedMemory(name=frame["shm"])
+    try:
+        with shm.buf[:frame["length"]] as view:
+            img = Image.frombytes(frame["mode"], frame["size"], view)
+    finally:
+        shm.close()
+        shm.unlink()
+    if frame["dpi"]:
+        img.info["dpi"] = frame["dpi"]
+    return img
+
+def discard_frame(frame):
+    try:
+        shm = shared_memory.SharedMemory(name=frame["shm"])
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+def _get(q, stop):
+    """Take the next item from q, or None once stop is set."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return None
+
+def _put(q, item, stop):
+    """Put item on a bounded queue, waiting for room; False if stop is set first."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def render_page(pdf_document, page_num, options, stats):
+    """Render stage work for one page: a frame for the OCR stage, or the page's final
+    result when it is copied through or cannot be rendered."""
+    for attempt in range(options["page_retries"] + 1):
+        try:
+            page = pdf_document.load_page(page_num)
+            result = skipped_result(page, options, stats)
+            if result is None:
+                with stats.time("render"):
+                    img, rect = page_image(page, options)
+                    frame = write_frame(img)
+                return {"page_num": page_num, "frame": frame, "rect": tuple(rect), "stats": stats.as_dict()}
+            break
+        except Exception as e:
+            LOGGER.error(f"Error rendering page {page_num} (attempt {attempt + 1}): {e}")
+            stats.count("page_errors")
+            error = e
+    else:
+        result = failed_result(error)
+    if stats.enabled:
+        result["stats"] = stats.as_dict()
+    return {"page_num": page_num, "result": result}
+
+def render_worker(pdf_path, pages, frames, results, stop, options, current):
+    """Render stage process: classify and render pages with its own document handle.
+
+    Pages arrive on pages from the assembler, which only hands out a page once an
+    earlier one is written, so rendering never runs more than the window ahead. current
+    holds the page being worked on, so the assembler can fail it if the process dies.
+    """
+    limit_worker_memory(options["max_memory"])
+    open_stats = ConversionStats() if options["stats"] else NULL_STATS
+    with open_stats.time("open"):
+        pdf_document = fitz.open(pdf_path)
+    try:
+        while True:
+            page_num = _get(pages, stop)
+            if page_num is None:
+                return
+            current.value = page_num
+            stats = ConversionStats() if options["stats"] else NULL_STATS
+            # The worker's document open is booked on its first page
+            stats.merge(open_stats.as_dict())
+            open_stats = NULL_STATS
+            item = render_page(pdf_document, page_num, options, stats)
+            if "frame" in item:
+                if not _put(frames, item, stop):
+                    discard_frame(item["frame"])
+                    return
+            elif not _put(results, item, stop):
+                return
+            current.value = IDLE
+    finally:
+        pdf_document.close()
+        # Anything still queued is abandoned, so do not wait on it at exit
+        frames.cancel_join_thread()
+        results.cancel_join_thread()
+
+def ocr_frame(item, load_page, options, stats, stop):
+    """OCR stage work for one frame, retried like process_page; None once stop is set."""
+    try:
+        img = read_frame(item["frame"])
+    except Exception as e:
+        return failed_result(e)
+    for attempt in range(options["page_retries"] + 1):
+        try:
+            return ocr_image(img, item["rect"], load_page, options, stats, stop)
+        except ConversionCancelled:
+            return None
+        except Exception as e:
+            LOGGER.error(f"Error OCRing page {item['page_num']} (attempt {attempt + 1}): {e}")
+            stats.count("page_errors")
+            error = e
+    return failed_result(error)
+
+def ocr_worker(pdf_path, frames, results, stop, options, current):
+    """OCR stage process: recognise frames with a resident engine.
+
+    The source is only opened for pages that need a finer render on a second pass.
+    current holds the page being worked on, as in render_worker.
+    """
+    limit_worker_memory(options["max_memory"])
+    documents = []
+
+    def load_page(page_num):
+        if not documents:
+            documents.append(fitz.open(pdf_path))
+        return documents[0].load_page(page_num)
+
+    try:
+        while True:
+            item = _get(frames, stop)
+            if item is None:
+                return
+            current.value = item["page_num"]
+            stats = ConversionStats() if options["stats"] else NULL_STATS
+            stats.merge(item["stats"])
+            result = ocr_frame(item, lambda: load_page(item["page_num"]), options, stats, stop)
+            if result is None:
+                return
+            if stats.enabled:
+                result["stats"] = stats.as_dict()
+            if not _put(results, {"page_num": item["page_num"], "result": result}, stop):
+                return
+            current.value = IDLE
+    finally:
+        for document in documents:
+            document.close()
+        results.cancel_join_thread()
+
+class Stage:
+    """One stage process, with the page it is working on, restartable after it dies."""
+
+    def __init__(self, target, args):
+        self.target = target
+        self.args = args
+        self.current = multiprocessing.Value("i", IDLE, lock=False)
+        self.process = None
+
+    def start(self):
+        self.current.value = IDLE
+        self.process = multiprocessing.Process(target=self.target, daemon=True, args=self.args + (self.current,))
+        self.process.start()
+
+    def died(self):
+        """True once the process has exited; stages only exit by themselves when stopped."""
+        return self.process.exitcode is not None
+
+def stop_pipeline(processes, pages, frames, results, stop):
+    stop.set()
+    deadline = time.monotonic() + STOP_GRACE
+    for process in processes:
+        process.join(max(0.0, deadline - time.monotonic()))
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+            process.join()
+    # Frames rendered but never OCRed still hold shared memory
+    while True:
+        try:
+            item = frames.get_nowait()
+        except (queue.Empty, OSError, ValueError):
+            break
+        discard_frame(item["frame"])
+    for q in (pages, frames, results):
+        q.cancel_join_thread()
+        q.close()
+
+def iter_pipeline_results(pdf_path, page_nums, options, render_workers=None, ocr_workers=None, window=None,
+                          cancel=None):
+    """Yield (page_num, ocr_result) for each of page_nums, in that order, from a staged pipeline.
+
+    render_workers processes classify and render pages (CPU-bound MuPDF work) and pass
+    the page images to ocr_workers processes through shared memory blocks rather than
+    pickles; this process assembles the results in page order. The stages are joined by
+    bounded queues, so a stage that falls behind holds the one before it back, and at
+    most window pages are between rendering and assembly at any time. ocr_workers
+    defaults to os.cpu_count(), render_workers to a quarter of that and window to twice
+    the number of stage processes.
+
+    Like iter_page_results, a page that makes no progress for stall_timeout is passed
+    through as failed, and ConversionCancelled is raised once cancel is set. A stage
+    process that dies fails the page it was working on at once and is replaced.
+    Frames rely on POSIX shared memory, so this only runs on POSIX systems.
+    """
+    ocr_workers = ocr_workers or os.cpu_count() or 1
+    render_workers = render_workers or max(1, ocr_workers // 4)
+    window = window or 2 * (render_workers + ocr_workers)
+    pages = multiprocessing.Queue()
+    frames = multiprocessing.Queue(maxsize=FRAMES_PER_OCR_WORKER * ocr_workers)
+    results = multiprocessing.Queue(maxsize=window)
+    stop = multiprocessing.Event()
+    # One resource tracker for every stage: a frame block is registered by the render
+    # process that makes it and unregistered by the OCR process that unlinks it
+    resource_tracker.ensure_running()
+    # Pages are handed out in order, a window's worth up front and one more as each is
+    # written, so the page the assembler waits for is always already with the render stage
+    unsent = iter(page_nums)
+    for page_num in itertools.islice(unsent, window):
+        pages.put(page_num)
+
+    stages = [Stage(render_worker, (pdf_path, pages, frames, results, stop, options)) for _ in range(render_workers)]
+    stages += [Stage(ocr_worker, (pdf_path, frames, results, stop, options)) for _ in range(ocr_workers)]
+    stall = stall_timeout(options, 1)
+    buffered = {}
+    abandoned = set()
+    try:
+        for stage in stages:
+            stage.start()
+        for page_num in page_nums:
+            waited = 0.0
+            while page_num not in buffered:
+                check_cancelled(cancel)
+                for stage in stages:
+                    if not stage.died():
+                        continue
+                    lost = stage.current.value
+                    LOGGER.error(f"Pipeline stage {stage.target.__name__} died (exit code {stage.process.exitcode})"
+                                 + (f" on page {lost}; it is passed through un-OCRed" if lost != IDLE else ""))
+                    if lost != IDLE and lost not in buffered:
+                        buffered[lost] = failed_result(RuntimeError("worker process died"))
+                        abandoned.add(lost)
+                    stage.start()
+                try:
+                    item = results.get(timeout=POLL_SECONDS)
+                except queue.Empty:
+                    waited += POLL_SECONDS
+                    if stall and waited > stall:
+                        LOGGER.error(f"Page {page_num} of {os.path.basename(pdf_path)} hung and is passed through un-OCRed")
+                        buffered[page_num] = failed_result(TimeoutError("worker hung"))
+                        abandoned.add(page_num)
+                    continue
+                waited = 0.0
+                if item["page_num"] not in abandoned:
+                    buffered[item["page_num"]] = item["result"]
+            next_page = next(unsent, None)
+            if next_page is not None:
+                pages.put(next_page)
+            yield page_num, buffered.pop(page_num)
+    finally:
+        stop_pipeline([stage.process for stage in stages if stage.process], pages, frames, results, stop)
@@ -1,67 +1,1222 @@
 import fitz  # PyMuPDF
+import numpy as np
 import pytesseract
 from PIL import Image
 import io
 import os
+import shutil
+import sqlite3
+import itertools
+import functools
+import collections
 from pypdf import PdfReader, PdfWriter
+from ocr_engine import get_engine
+from ocr_cache import DEFAULT_CACHE_DIR, USER_CACHE_DIR, get_cache
+from streaming_pdf import StreamingPdfWriter
+from conversion_journal import ConversionJournal
+from pdf_optimize import check_linearize, linearize_pdf, optimize_pdf
+from conversion_stats import NULL_STATS, ConversionStats, write_stats
+from ocr_sidecars import SIDECAR_FORMATS, open_sidecars
+from source_files import open_source
+import threading
 import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
 import logging
+try:
+    import resource
+except ImportError:  # not on Windows; worker memory caps are POSIX only
+    resource = None
 logging.basicConfig(level=logging.INFO)
 LOGGER = logging.getLogger(__name__)
 pytesseract.pytesseract.tesseract_cmd = r"C:\\Program Files\\Tesseract-OCR\\tesseract.exe"
 
+# Set in process-pool workers by init_worker: the pool's cancel token, or the shared
+# array of per-job cancel flags when one pool serves many jobs (see CancelFlag)
+_worker_cancel = None
+_worker_cancel_flags = None
+
+# Render resolution used unless the caller asks for another (or for dpi="auto")
+DEFAULT_DPI = 111
+
+# Pages handed to a process-pool worker at a time; small enough to balance load, large
+# enough that opening the document in the worker is amortised
+PROCESS_CHUNK_PAGES = 4
+
+# "pdf" rebuilds every page from Tesseract's PDF output; "overlay" keeps the source pages
+# and only adds an invisible text layer
+OUTPUT_MODES = ("pdf", "overlay")
+
+# Base-14 font used for the invisible overlay text; glyph shapes never show
+OVERLAY_FONT = "helv"
+
+# Share of the page an embedded image must cover to be OCRed directly instead of rendering
+NATIVE_IMAGE_COVERAGE = 0.95
+
+# A page with at least this many characters in a real font already has a usable text layer
+MIN_TEXT_CHARS = 20
+
+# A page whose images cover this much of it is treated as a scan even with stray text on it
+SCANNED_IMAGE_COVERAGE = 0.5
+
+# dpi="auto": pages are probed at PROBE_DPI, fine enough to resolve small print, and OCRed
+# at the lowest dpi that makes a text line about ADAPTIVE_LINE_PX pixels tall (x-height
+# around 20px, where Tesseract is most accurate), within the limits below. Pages whose
+# lines are under SMALL_PRINT_PT points get at least SMALL_PRINT_DPI.
+PROBE_DPI = 150
+ADAPTIVE_LINE_PX = 40
+ADAPTIVE_MIN_DPI = 70
+ADAPTIVE_MAX_DPI = 400
+SMALL_PRINT_PT = 9
+SMALL_PRINT_DPI = 300
+
+# Render resolution for the second pass of selective re-OCR (see ocr_page)
+REOCR_DPI = 300
+
+# Orientation detection runs on a thumbnail at OSD_DPI, and a page is only turned when
+# Tesseract's orientation confidence reaches OSD_MIN_CONFIDENCE (OCRmyPDF's default)
+OSD_DPI = 100
+OSD_MIN_CONFIDENCE = 14
+
+# Blank page check: a BLANK_PROBE_DPI thumbnail, minus a BLANK_MARGIN border (scanner
+# edges, punch holes), is blank when it is nearly flat or when both its share of ink
+# pixels (INK_DELTA darker than the paper) and of edge pixels (EDGE_DELTA jumps between
+# neighbours) stay within the blank threshold
+BLANK_PROBE_DPI = 50
+BLANK_MARGIN = 0.05
+BLANK_FLAT_STD = 4
+INK_DELTA = 80
+EDGE_DELTA = 48
+BLANK_THRESHOLD = 0.001
+
+# Fault isolation: a single OCR call gives up after PAGE_TIMEOUT seconds, a failing page is
+# tried PAGE_RETRIES more times before it is passed through un-OCRed, and pages are never
+# rendered or decoded beyond MAX_PAGE_PIXELS
+PAGE_TIMEOUT = 300
+PAGE_RETRIES = 2
+MAX_PAGE_PIXELS = 40_000_000
+
+# A worker task taking STALL_FACTOR times its pages' OCR timeouts is treated as hung
+# (a page may run the orientation pass, two OCR passes and its render)
+STALL_FACTOR = 4
+
+# Documents longer than this are only sampled by is_scanned_pdf
+DETECTION_SAMPLE_PAGES = 24
+
+# Persistent is_scanned_pdf results, keyed by file fingerprint; set to None to disable
+DETECTION_CACHE_PATH = os.environ.get("SCAN_DETECTION_CACHE",
+                                      os.path.join(USER_CACHE_DIR, "scan_detection", "scan_detection.sqlite"))
+
+# Bumped whenever the detection rules change so stale cached answers are ignored
+DETECTION_VERSION = 1
+
+
+
+def file_fingerprint(file_path):
+    """Return a cache key made of the file size and a hash of its first and last
+    FINGERPRINT_BLOCK bytes (see source_files.SourceFile.fingerprint)."""
+    with open_source(file_path) as source:
+        return source.fingerprint()
+
+def _detection_cache():
+    os.makedirs(os.path.dirname(DETECTION_CACHE_PATH) or ".", mode=0o700, exist_ok=True)
+    connection = sqlite3.connect(DETECTION_CACHE_PATH, timeout=30)
+    connection.execute("CREATE TABLE IF NOT EXISTS scanned (fingerprint TEXT PRIMARY KEY, version INTEGER, scanned INTEGER)")
+    return connection
+
+def sample_page_numbers(page_count):
+    """Pages checked by is_scanned_pdf: all of them for short files, else an even spread."""
+    if page_count <= DETECTION_SAMPLE_PAGES:
+        return range(page_count)
+    step = (page_count - 1) / (DETECTION_SAMPLE_PAGES - 1)
+    return sorted({round(i * step) for i in range(DETECTION_SAMPLE_PAGES)})
+
+def has_text_layer(page):
+    """True if a fitz page carries real text: enough characters set in an actual font."""
+    return len("".join(page.get_text("text").split())) >= MIN_TEXT_CHARS and bool(page.get_fonts())
+
+def detect_scanned_pdf(file_path):
+    """Uncached detection: stop at the first sampled page that has real text."""
+    with open_source(file_path) as source, source.open_pdf() as pdf_document:
+        for page_num in sample_page_numbers(pdf_document.page_count):
+            if has_text_layer(pdf_document.load_page(page_num)):
+                return False
+    return True
 
 def is_scanned_pdf(file_path):
-    """Check if a PDF is a scanned PDF by trying to extract text."""
+    """Check if a PDF is a scanned PDF, i.e. none of its (sampled) pages has a text layer.
+
+    Answers are cached in DETECTION_CACHE_PATH by file fingerprint, so the watcher and the
+    GUI seeing the same file again costs one small read instead of a parse. On a miss the
+    fingerprint and the detection share one mapping of the file (see source_files).
+    """
     try:
-        with open(file_path, 'rb') as file:
-            pdf_reader = PdfReader(file)
-            for page in pdf_reader.pages:
-                if page.extract_text():
-                    return False
-            return True
-    except Exception as e:
+        source = open_source(file_path)
+    except OSError as e:
         LOGGER.warning(f"Failed to process PDF: {os.path.basename(file_path)} - {e}")
         return False
+    with source:
+        try:
+            fingerprint = file_fingerprint(file_path)
+            connection = _detection_cache() if DETECTION_CACHE_PATH else None
+        except (OSError, sqlite3.Error) as e:
+            LOGGER.warning(f"Scan detection cache unavailable for {os.path.basename(file_path)} - {e}")
+            fingerprint = connection = None
+        try:
+            if connection:
+                row = connection.execute("SELECT scanned FROM scanned WHERE fingerprint = ? AND version = ?",
+                                         (fingerprint, DETECTION_VERSION)).fetchone()
+                if row:
+                    return bool(row[0])
+            try:
+                scanned = detect_scanned_pdf(file_path)
+            except Exception as e:
+                LOGGER.warning(f"Failed to process PDF: {os.path.basename(file_path)} - {e}")
+                return False
+            if connection:
+                with connection:
+                    connection.execute("INSERT OR REPLACE INTO scanned VALUES (?, ?, ?)",
+                                       (fingerprint, DETECTION_VERSION, int(scanned)))
+            return scanned
+        finally:
+            if connection:
+                connection.close()
+
+def classify_page(page):
+    """Classify a fitz page as "text" (has a usable text layer) or "scanned" (needs OCR).
+
+    Looks at the amount of extractable text, whether the page uses any fonts and how much
+    of it is covered by images. Pages with neither text nor images are "text": there is
+    nothing for OCR to find on them.
+    """
+    text_chars = len("".join(page.get_text("text").split()))
+    if text_chars >= MIN_TEXT_CHARS and page.get_fonts():
+        return "text"
+    page_area = abs(page.rect)
+    image_area = 0
+    for img in page.get_images(full=True):
+        for rect in page.get_image_rects(img[0]):
+            image_area += abs(rect & page.rect)
+    if not image_area:
+        return "text"
+    if text_chars == 0 or image_area >= SCANNED_IMAGE_COVERAGE * page_area:
+        return "scanned"
+    return "text"
+
+def page_ink_stats(page):
+    """Ink coverage, grey level standard deviation and edge density of a page thumbnail."""
+    pix = page.get_pixmap(matrix=fitz.Matrix(BLANK_PROBE_DPI / 72, BLANK_PROBE_DPI / 72), colorspace=fitz.csGRAY,
+                          alpha=False)
+    gray = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    margin_y, margin_x = int(gray.shape[0] * BLANK_MARGIN), int(gray.shape[1] * BLANK_MARGIN)
+    gray = gray[margin_y:gray.shape[0] - margin_y, margin_x:gray.shape[1] - margin_x].astype(np.int16)
+    if not gray.size:
+        return 0.0, 0.0, 0.0
+    paper = np.percentile(gray, 90)
+    ink = float((gray < paper - INK_DELTA).mean())
+    edges = (np.abs(np.diff(gray, axis=0)) > EDGE_DELTA).sum() + (np.abs(np.diff(gray, axis=1)) > EDGE_DELTA).sum()
+    return ink, float(gray.std()), float(edges / gray.size)
+
+def is_blank_page(page, threshold=BLANK_THRESHOLD):
+    """True when a page has (next to) nothing on it worth OCRing; see page_ink_stats."""
+    ink, std, edges = page_ink_stats(page)
+    return std < BLANK_FLAT_STD or (ink <= threshold and edges <= threshold)
+
+def embedded_page_image(page):
+    """Return a scanned page's embedded image at native resolution, or None.
+
+    Only pages that are a single unrotated image covering the page qualify; anything with
+    a text layer, several images, a soft mask or an odd placement has to be rendered.
+    """
+    images = page.get_images(full=True)
+    if len(images) != 1 or page.rotation or page.get_text("text").strip():
+        return None
+    xref, smask, width, height = images[0][:4]
+    # Oversized images are rendered at a capped dpi rather than decoded whole
+    if smask or width * height > MAX_PAGE_PIXELS:
+        return None
+    placements = page.get_image_rects(xref, transform=True)
+    if len(placements) != 1:
+        return None
+    rect, matrix = placements[0]
+    # Rotated or mirrored placements would need the same transform applied before OCR
+    if matrix.b or matrix.c or matrix.a <= 0 or matrix.d <= 0:
+        return None
+    if abs(rect & page.rect) < NATIVE_IMAGE_COVERAGE * abs(page.rect):
+        return None
+    base_image = page.parent.extract_image(xref)
+    if not base_image:
+        return None
+    img = Image.open(io.BytesIO(base_image["image"]))
+    img.load()
+    if img.mode not in ("1", "L", "RGB"):
+        img = img.convert("RGB")
+    img.info["dpi"] = (round(img.width * 72 / rect.width), round(img.height * 72 / rect.height))
+    return img, rect
+
+def estimate_line_height(gray, dpi):
+    """Estimate the median text line height, in points, of a grayscale image array.
+
+    Text lines are the runs of rows in the horizontal ink projection; runs too thin to be
+    text or too tall to be a single line (pictures, rules) are ignored. Returns None when
+    fewer than three lines are found.
+    """
+    ink_rows = (gray < 200).sum(axis=1) > 0.005 * gray.shape[1]
+    # Rising and falling edges of the ink profile delimit the runs
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], ink_rows.astype(np.int8), [0]))))
+    heights = edges[1::2] - edges[::2]
+    heights = heights[(heights >= 2) & (heights <= 0.2 * gray.shape[0])]
+    if len(heights) < 3:
+        return None
+    return float(np.median(heights)) * 72 / dpi
+
+def choose_dpi(line_height):
+    """The lowest dpi that renders a line_height point text line at ADAPTIVE_LINE_PX,
+    and at least SMALL_PRINT_DPI for small print."""
+    if not line_height:
+        return None
+    dpi = ADAPTIVE_LINE_PX * 72 / line_height
+    if line_height < SMALL_PRINT_PT:
+        dpi = max(dpi, SMALL_PRINT_DPI)
+    # Round up to a multiple of 10 to keep cache keys and page sizes tidy
+    return int(min(ADAPTIVE_MAX_DPI, max(ADAPTIVE_MIN_DPI, -(-dpi // 10) * 10)))
+
+def probe_page_dpi(page, default_dpi):
+    """Pick a dpi for a page from a cheap low-resolution grayscale render."""
+    pix = page.get_pixmap(matrix=fitz.Matrix(PROBE_DPI / 72, PROBE_DPI / 72), colorspace=fitz.csGRAY, alpha=False)
+    gray = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    return choose_dpi(estimate_line_height(gray, PROBE_DPI)) or default_dpi
+
+def fit_image_to_text(img):
+    """Downscale a native image to the dpi its text needs; never upsample."""
+    native_dpi = img.info["dpi"][0]
+    probe_dpi = min(PROBE_DPI, native_dpi)
+    scale = probe_dpi / native_dpi
+    probe = img.convert("L").resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BILINEAR)
+    dpi = choose_dpi(estimate_line_height(np.asarray(probe), probe_dpi))
+    if not dpi or dpi >= native_dpi:
+        return img
+    if img.mode == "1":
+        img = img.convert("L")
+    resized = img.resize((round(img.width * dpi / native_dpi), round(img.height * dpi / native_dpi)), Image.LANCZOS)
+    resized.info["dpi"] = (dpi, dpi)
+    return resized
+
+def pixmap_to_image(pix):
+    """Wrap a pixmap's samples in a PIL image without copying or PNG re-encoding them.
 
-def process_page(page_num, pdf_document, dpi):
+    The image shares the pixmap's memory, so the pixmap is kept alive alongside it.
+    """
+    mode = "L" if pix.n == 1 else "RGB"
+    img = Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1)
+    img.pixmap = pix
+    return img
+
+def page_image(page, options):
+    """Return (image, placement rect) for OCR, preferring the native embedded image.
+
+    With dpi="auto" the image is sized to the page's text: embedded images are downscaled
+    when their text is large, and rendered pages use the dpi picked by probe_page_dpi.
+    """
+    if options["native_images"]:
+        try:
+            embedded = embedded_page_image(page)
+        except Exception as e:
+            LOGGER.debug(f"Falling back to rendering page {page.number}: {e}")
+            embedded = None
+        if embedded:
+            img, rect = embedded
+            if options["dpi"] == "auto":
+                img = fit_image_to_text(img)
+            return img, rect
+    dpi = options["dpi"]
+    if dpi == "auto":
+        dpi = probe_page_dpi(page, DEFAULT_DPI)
+    dpi = min(dpi, int(72 * (MAX_PAGE_PIXELS / abs(page.rect)) ** 0.5))
+    colorspace = fitz.csGRAY if options["colorspace"] == "gray" else fitz.csRGB
+    pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72), colorspace=colorspace, alpha=False)
+    img = pixmap_to_image(pix)
+    img.info["dpi"] = (dpi, dpi)
+    return img, page.rect
+
+def detect_rotation(img, options, stats=NULL_STATS):
+    """Clockwise rotation (0, 90, 180 or 270) that turns the page in img upright.
+
+    Tesseract OSD runs on a grayscale thumbnail at OSD_DPI and its answers are cached by
+    the thumbnail's pixels. Pages it cannot read or is unsure about are left as they are.
+    """
+    dpi = img.info.get("dpi", (DEFAULT_DPI,))[0]
+    thumb = img.convert("L")
+    if dpi > OSD_DPI:
+        scale = OSD_DPI / dpi
+        thumb = thumb.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))))
+    ocr_engine = get_engine(psm=0, engine=options["engine"], timeout=options["page_timeout"] or 0)
+    cache = get_cache(options["ocr_cache"])
     try:
-        page = pdf_document.load_page(page_num)
-        pix = page.get_pixmap(matrix=fitz.Matrix(dpi / 72, dpi / 72))
-        img = Image.open(io.BytesIO(pix.tobytes()))
-        ocr_pdf = pytesseract.image_to_pdf_or_hocr(img, extension='pdf', config='--psm 3')
-        ocr_pdf_reader = PdfReader(io.BytesIO(ocr_pdf))
-        ocr_pdf_page = ocr_pdf_reader.pages[0]
-        return page_num, ocr_pdf_page
+        with stats.time("osd"):
+            if cache is not None:
+                osd, _ = cache.get_or_compute(thumb, lambda: ocr_engine.osd(thumb), ocr_engine.name, kind="osd")
+            else:
+                osd = ocr_engine.osd(thumb)
     except Exception as e:
-        print(f"Error processing page {page_num}: {e}")
-        return page_num, None
+        # Usually too little text to tell
+        LOGGER.debug(f"Orientation detection failed - {e}")
+        return 0
+    return osd["rotate"] if osd["confidence"] >= OSD_MIN_CONFIDENCE else 0
+
+def upright_image(img, rotation):
+    """img turned clockwise by rotation degrees, keeping its dpi."""
+    if not rotation:
+        return img
+    rotated = img.rotate(-rotation, expand=True)
+    if "dpi" in img.info:
+        rotated.info["dpi"] = img.info["dpi"]
+    return rotated
+
+def word_confidence(words):
+    """Mean and minimum Tesseract confidence (0-100) over words; None for both if there are none."""
+    confidences = [word["conf"] for word in words if word["conf"] >= 0]
+    if not confidences:
+        return {"mean": None, "min": None}
+    return {"mean": round(sum(confidences) / len(confidences), 1), "min": round(min(confidences), 1)}
+
+def recognize(img, rect, options, psm=3, rotation=0, stats=NULL_STATS):
+    """OCR a prepared page image, turned by rotation first, into the result dict described in ocr_page."""
+    if rotation:
+        with stats.time("rotate"):
+            img = upright_image(img, rotation)
+    ocr_engine = get_engine(psm=psm, engine=options["engine"], timeout=options["page_timeout"] or 0)
+    cache = get_cache(options["ocr_cache"])
+    scored = options["min_confidence"] is not None
+    if options["output_mode"] == "overlay":
+        kind, recognise = "words", ocr_engine.image_to_words
+    elif scored or options["sidecars"]:
+        # Word confidences and sidecar text come from the same recognition as the PDF
+        kind, recognise = "pdf+words", ocr_engine.image_to_pdf_and_words
+    else:
+        kind, recognise = "pdf", ocr_engine.image_to_pdf
+
+    def compute():
+        with stats.time("ocr"):
+            return recognise(img)
+
+    if cache is not None:
+        with stats.time("cache"):
+            key_config = {"kind": kind, "lang": ocr_engine.lang, "psm": ocr_engine.psm, "dpi": img.info.get("dpi")}
+            output, cache_hit = cache.get_or_compute(img, compute, ocr_engine.name, **key_config)
+        stats.count("cache_hits" if cache_hit else "cache_misses")
+    else:
+        output, cache_hit = compute(), False
+    dpi = img.info.get("dpi", (None,))[0]
+    if kind == "words":
+        words = output
+        result = {"status": "ocr", "size": img.size, "rect": tuple(rect), "words": words, "cache_hit": cache_hit, "dpi": dpi}
+    else:
+        pdf, words = output if kind == "pdf+words" else (output, None)
+        result = {"status": "ocr", "pdf": pdf, "cache_hit": cache_hit, "dpi": dpi}
+        stats.count("ocr_pdf_bytes", len(pdf))
+        if options["sidecars"]:
+            result["size"], result["words"] = img.size, words
+    result["rotation"] = rotation
+    if scored:
+        result["confidence"] = word_confidence(words)
+    return result
+
+def needs_reocr(result, options):
+    mean = result["confidence"]["mean"]
+    return mean is None or mean < options["min_confidence"]
+
+def ocr_page(page, options, stats=NULL_STATS, cancel=None):
+    """OCR a single fitz page.
+
+    Returns a result dict with status "ocr" and, for output_mode="pdf", the Tesseract PDF
+    bytes under "pdf"; for "overlay", the image size, where the image sits on the page and
+    the recognised words with their pixel boxes (pdf results carry the words and image
+    size too when options["sidecars"] is set). "cache_hit" says whether the OCR output
+    came from the OCR cache and "dpi" is the resolution the page was OCRed at.
+
+    With options["auto_rotate"] the page's orientation is detected first (see
+    detect_rotation) and sideways or upside-down scans are turned upright before OCR;
+    "rotation" is the clockwise turn applied, with words and PDF in the upright frame.
+
+    With options["min_confidence"] set the result also carries the page's word
+    "confidence" (mean and min) and the number of OCR "passes": a page whose mean
+    confidence falls below the threshold is OCRed again at reocr_dpi and/or reocr_psm,
+    and whichever pass scored higher is kept.
+
+    stats (a conversion_stats.ConversionStats) collects the time spent in each stage, and
+    cancel, a cancel token, is checked before every OCR call (see check_cancelled).
+    """
+    with stats.time("render"):
+        img, rect = page_image(page, options)
+    return ocr_image(img, rect, lambda: page, options, stats, cancel)
+
+def ocr_image(img, rect, load_page, options, stats=NULL_STATS, cancel=None):
+    """OCR a page already rendered by page_image into the result described in ocr_page.
+
+    load_page() returns the fitz page again, for the finer render of a second pass.
+    """
+    rotation = detect_rotation(img, options, stats) if options["auto_rotate"] else 0
+    check_cancelled(cancel)
+    result = recognize(img, rect, options, rotation=rotation, stats=stats)
+    if options["min_confidence"] is None:
+        return result
+    result["passes"] = 1
+    if needs_reocr(result, options):
+        # Second pass: a finer render, a different page segmentation, or both
+        sharper = (result["dpi"] or 0) < options["reocr_dpi"]
+        if sharper or options["reocr_psm"]:
+            if sharper:
+                with stats.time("render"):
+                    img, rect = page_image(load_page(), dict(options, dpi=options["reocr_dpi"], native_images=False))
+            check_cancelled(cancel)
+            retry = recognize(img, rect, options, psm=options["reocr_psm"] or 3, rotation=rotation, stats=stats)
+            stats.count("reocr_pages")
+            if (retry["confidence"]["mean"] or 0) >= (result["confidence"]["mean"] or 0):
+                result = retry
+            result["passes"] = 2
+    return result
+
+def failed_result(error):
+    """Result for a page that could not be OCRed; writers pass such pages through as they are."""
+    return {"status": "failed", "error": str(error) or type(error).__name__}
+
+class ConversionCancelled(Exception):
+    """The conversion was stopped through its cancel token."""
+
+def check_cancelled(cancel):
+    """Raise ConversionCancelled if the cancel token (anything with is_set(), such as a
+    threading or multiprocessing Event) has been set."""
+    if cancel is not None and cancel.is_set():
+        raise ConversionCancelled("Conversion cancelled")
+
+class CancelFlag:
+    """Cancel token backed by one slot of a shared byte array.
+
+    A process pool gets its cancel tokens once, when the workers start, so a pool that
+    serves many jobs shares an array of flags and each job owns a slot of it.
+    """
+
+    def __init__(self, flags, slot):
+        self.flags = flags
+        self.slot = slot
+
+    def is_set(self):
+        return bool(self.flags[self.slot])
+
+    def set(self):
+        self.flags[self.slot] = 1
+
+    def clear(self):
+        self.flags[self.slot] = 0
+
+def skipped_result(page, options, stats=NULL_STATS):
+    """The result for a page that is copied through without OCR, or None if it needs OCR."""
+    with stats.time("classify"):
+        if options["skip_text_pages"] and classify_page(page) == "text":
+            # Born-digital pages are copied through as they are
+            return {"status": "text"}
+        if options["blank_threshold"] is not None and is_blank_page(page, options["blank_threshold"]):
+            # Blank backs of duplex scans are copied through without OCR
+            return {"status": "blank"}
+    return None
+
+def classify_and_ocr(page, options, stats=NULL_STATS, cancel=None):
+    return skipped_result(page, options, stats) or ocr_page(page, options, stats, cancel)
+
+def process_page(page_num, pdf_document, options, cancel=None):
+    """Classify and OCR one page, retrying up to options["page_retries"] times on errors.
+
+    With options["stats"] the result carries the page's stage timings and counters under
+    "stats" (see conversion_stats). Raises ConversionCancelled, without retrying, once the
+    cancel token is set.
+    """
+    check_cancelled(cancel)
+    stats = ConversionStats() if options["stats"] else NULL_STATS
+    for attempt in range(options["page_retries"] + 1):
+        try:
+            result = classify_and_ocr(pdf_document.load_page(page_num), options, stats, cancel)
+            break
+        except ConversionCancelled:
+            raise
+        except Exception as e:
+            LOGGER.error(f"Error processing page {page_num} (attempt {attempt + 1}): {e}")
+            stats.count("page_errors")
+            error = e
+    else:
+        result = failed_result(error)
+    if stats.enabled:
+        result["stats"] = stats.as_dict()
+    return page_num, result
+
+def limit_worker_memory(max_bytes):
+    """Process-pool initializer: cap the worker's address space at max_bytes, so a runaway
+    page raises MemoryError in its worker instead of exhausting the machine."""
+    if not max_bytes:
+        return
+    if resource is None:
+        LOGGER.warning("Worker memory caps are not supported on this platform")
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    resource.setrlimit(resource.RLIMIT_AS, (max_bytes, hard))
+
+def init_worker(max_memory=None, cancel=None, cancel_flags=None):
+    """Process-pool initializer: apply the memory cap (see limit_worker_memory) and keep the
+    pool's cancel token, a multiprocessing Event, or its array of per-job cancel flags."""
+    global _worker_cancel, _worker_cancel_flags
+    limit_worker_memory(max_memory)
+    _worker_cancel = cancel
+    _worker_cancel_flags = cancel_flags
 
-def convert_scanned_pdf_to_ocr(pdf_path,*args,dpi=111):
+def stall_timeout(options, pages):
+    """Seconds a worker task of pages may run before it is treated as hung, or None."""
+    if not options["page_timeout"]:
+        return None
+    return options["page_timeout"] * STALL_FACTOR * (options["page_retries"] + 1) * pages
+
+def shutdown_executor(executor, stalled=False):
+    """Shut an executor down, without waiting on hung tasks when there are any.
+
+    Hung worker processes are terminated; hung threads cannot be stopped and are left to
+    finish in the background.
+    """
+    if not stalled:
+        # Tasks not yet started are dropped when a conversion stops early
+        executor.shutdown(wait=True, cancel_futures=True)
+        return
+    # ProcessPoolExecutor has no public way to stop a busy worker before Python 3.14
+    processes = list((getattr(executor, "_processes", None) or {}).values())
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+def process_page_range(pdf_path, page_nums, options, cancel_slot=None):
+    """Process-pool worker: OCR a run of pages with the worker's own document handle.
+
+    Returns (page_num, ocr_result) pairs; OCR results are plain dicts, which pickle back
+    to the parent cheaply where pypdf page objects do not. The pages are checked against
+    the pool's cancel token, or against slot cancel_slot of its cancel flags when given
+    (see init_worker).
+    """
+    if cancel_slot is not None and _worker_cancel_flags is not None:
+        cancel = CancelFlag(_worker_cancel_flags, cancel_slot)
+    else:
+        cancel = _worker_cancel
+    check_cancelled(cancel)
+    stats = ConversionStats() if options["stats"] else NULL_STATS
+    with stats.time("open"):
+        pdf_document = fitz.open(pdf_path)
+    try:
+        results = [process_page(page_num, pdf_document, options, cancel) for page_num in page_nums]
+    finally:
+        pdf_document.close()
+    if stats.enabled and results:
+        # The worker's own document open is booked on the first page of the chunk
+        first_stats = ConversionStats()
+        first_stats.merge(results[0][1]["stats"])
+        first_stats.merge(stats.as_dict())
+        results[0][1]["stats"] = first_stats.as_dict()
+    return results
+
+def page_chunks(page_nums, workers):
+    """Split page_nums into consecutive chunks of at most PROCESS_CHUNK_PAGES."""
+    chunk_size = max(1, min(PROCESS_CHUNK_PAGES, -(-len(page_nums) // workers)))
+    return [page_nums[start:start + chunk_size] for start in range(0, len(page_nums), chunk_size)]
+
+def ordered_results(executor, fn, items, window=None, timeout=None, on_timeout=None, rebuild=None, on_broken=None):
+    """Run fn over items in executor and yield the results in item order.
+
+    At most window calls are in flight at once (all of them when window is None), which
+    bounds how many finished results can pile up waiting for an earlier one. timeout(item)
+    gives the seconds to wait for an item's result; when that runs out the call is given
+    up on and on_timeout(item) is yielded in its place.
+
+    With rebuild, a process pool that breaks (a worker killed by its memory cap or a
+    crash) is replaced by rebuild(), which returns the new executor. Every call in flight
+    fails with the pool, so the item being waited on is run again on its own: if it
+    breaks the new pool too, on_broken(item) is yielded in its place. The other calls
+    lost with the pool are resubmitted.
+    """
+    items = iter(items)
+    pending = collections.deque((item, executor.submit(fn, item)) for item in itertools.islice(items, window))
+    while pending:
+        item, future = pending.popleft()
+        try:
+            result = future.result(timeout=timeout and timeout(item))
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            result = on_timeout(item)
+        except BrokenProcessPool:
+            if rebuild is None:
+                raise
+            executor = rebuild()
+            try:
+                result = executor.submit(fn, item).result(timeout=timeout and timeout(item))
+            except concurrent.futures.TimeoutError:
+                result = on_timeout(item)
+            except BrokenProcessPool as e:
+                LOGGER.error(f"Worker process died on {item}: {e}")
+                executor = rebuild()
+                result = on_broken(item)
+            pending = collections.deque((next_item, executor.submit(fn, next_item)) for next_item, _ in pending)
+        for next_item in itertools.islice(items, 1):
+            pending.append((next_item, executor.submit(fn, next_item)))
+        yield result
+
+def iter_page_results(pdf_path, pdf_document, page_nums, backend, workers, options, window=None, cancel=None,
+                      render_workers=None):
+    """Yield (page_num, ocr_result) for each of page_nums, in that order.
+
+    A worker task that hangs past its stall_timeout is given up on and its pages come back
+    as failed, so one pathological page cannot hold up the rest of the document. Workers
+    stop with ConversionCancelled once cancel is set; process workers only see a
+    multiprocessing Event, so any other token is left to the caller to check.
+    backend="pipeline" hands the pages to page_pipeline.iter_pipeline_results instead.
+    """
+    if backend == "pipeline":
+        # page_pipeline builds on this module, so it is only imported once needed
+        from page_pipeline import iter_pipeline_results
+        yield from iter_pipeline_results(pdf_path, page_nums, options, render_workers, workers, window, cancel)
+        return
+    stalled = []
+
+    def on_stall(pages):
+        LOGGER.error(f"Pages {pages} of {os.path.basename(pdf_path)} hung and are passed through un-OCRed")
+        stalled.append(pages)
+        return [(page_num, failed_result(TimeoutError("worker hung"))) for page_num in pages]
+
+    if backend == "process":
+        workers = workers or os.cpu_count() or 1
+        chunk_window = window and max(1, -(-window // PROCESS_CHUNK_PAGES))
+        worker_cancel = None if cancel is None or isinstance(cancel, threading.Event) else cancel
+
+        def new_executor():
+            return concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                          initargs=(options["max_memory"], worker_cancel))
+
+        def rebuild():
+            # A broken pool has already stopped its workers
+            nonlocal executor
+            executor.shutdown(wait=False, cancel_futures=True)
+            executor = new_executor()
+            return executor
+
+        def on_broken(pages):
+            LOGGER.error(f"Pages {pages} of {os.path.basename(pdf_path)} killed their worker and are passed "
+                         f"through un-OCRed")
+            return [(page_num, failed_result(RuntimeError("worker process died"))) for page_num in pages]
+
+        executor = new_executor()
+        try:
+            worker = functools.partial(process_page_range, pdf_path, options=options)
+            for results in ordered_results(executor, worker, page_chunks(page_nums, workers), chunk_window,
+                                           lambda chunk: stall_timeout(options, len(chunk)), on_stall,
+                                           rebuild, on_broken):
+                yield from results
+        finally:
+            shutdown_executor(executor, bool(stalled))
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        try:
+            worker = functools.partial(process_page, pdf_document=pdf_document, options=options, cancel=cancel)
+            for page_num, ocr_result in ordered_results(executor, worker, page_nums, window,
+                                                        lambda page_num: stall_timeout(options, 1),
+                                                        lambda page_num: on_stall([page_num])[0]):
+                yield page_num, ocr_result
+        finally:
+            shutdown_executor(executor, bool(stalled))
+
+def iter_journaled_results(journal, fresh_results, page_nums):
+    """Yield (page_num, ocr_result) for page_nums in order, taking finished pages from the
+    journal and recording every freshly OCRed one in it before handing it on."""
+    for page_num in page_nums:
+        if page_num in journal.completed:
+            yield page_num, journal.load(page_num)
+            continue
+        page_num, ocr_result = next(fresh_results)
+        # Failed pages are not journaled so that a rerun tries them again
+        if ocr_result and ocr_result["status"] != "failed":
+            journal.record(page_num, ocr_result)
+        yield page_num, ocr_result
+
+def ocr_page_size(original_page, ocr_result):
+    """Size of the output page for an OCR result: the original's, turned if the scan was."""
+    width, height = original_page.rect.width, original_page.rect.height
+    if ocr_result.get("rotation") in (90, 270):
+        return height, width
+    return width, height
+
+def merge_page_stats(stats, ocr_result):
+    """Fold a page result's worker stats and outcome into the conversion's stats."""
+    if not stats.enabled:
+        return
+    stats.count(f"pages_{ocr_result['status'] if ocr_result else 'failed'}")
+    if ocr_result:
+        stats.merge(ocr_result.get("stats"))
+
+def add_text_layer(page, ocr_result):
+    """Write OCR words onto a fitz page as invisible (render mode 3) text.
+
+    Words of a scan that was turned upright for OCR are laid out on the placement rect
+    turned the same way about its centre, and the finished text is turned back.
+    """
+    img_width, img_height = ocr_result["size"]
+    rotation = ocr_result.get("rotation", 0)
+    x0, y0, x1, y1 = ocr_result["rect"]
+    center = fitz.Point((x0 + x1) / 2, (y0 + y1) / 2)
+    if rotation in (90, 270):
+        half_width, half_height = (y1 - y0) / 2, (x1 - x0) / 2
+        x0, y0, x1, y1 = center.x - half_width, center.y - half_height, center.x + half_width, center.y + half_height
+    scale_x = (x1 - x0) / img_width
+    scale_y = (y1 - y0) / img_height
+    font = fitz.Font(OVERLAY_FONT)
+    writer = fitz.TextWriter(page.rect)
+    for word in ocr_result["words"]:
+        text = word["text"].strip()
+        text_length = font.text_length(text, fontsize=1)
+        if not text_length:
+            continue
+        # Size each word so its width matches the box Tesseract found, capped by the box height
+        width = word["width"] * scale_x
+        height = word["height"] * scale_y
+        fontsize = min(width / text_length, height)
+        baseline = fitz.Point(x0 + word["left"] * scale_x, y0 + (word["top"] + word["height"]) * scale_y)
+        writer.append(baseline, text, font=font, fontsize=fontsize)
+    # Scanners often leave the page's own "cm" unbalanced; the text must not inherit it
+    if not page.is_wrapped:
+        page.wrap_contents()
+    writer.write_text(page, render_mode=3, morph=(center, fitz.Matrix(rotation)) if rotation else None)
+
+class TextLayerWriter:
+    """Add invisible OCR text to a copy of the original pages and save it incrementally.
+
+    When page_nums is given the output keeps only those pages, which needs a full save.
+    The copy is written from source, the pdf_path SourceFile, when one is given.
+    """
+
+    def __init__(self, pdf_path, output_path, page_nums=None, stats=NULL_STATS, source=None):
+        self.stats = stats
+        with stats.time("open"):
+            if os.path.abspath(pdf_path) != os.path.abspath(output_path):
+                if source:
+                    source.copy_to(output_path)
+                else:
+                    shutil.copyfile(pdf_path, output_path)
+            self.output_document = fitz.open(output_path)
+        self.pdf_path = pdf_path
+        self.output_path = output_path
+        self.page_nums = page_nums
+
+    def add(self, page_num, ocr_result):
+        if ocr_result and ocr_result["status"] == "ocr" and ocr_result["words"]:
+            with self.stats.time("overlay"):
+                add_text_layer(self.output_document.load_page(page_num), ocr_result)
+
+    def close(self):
+        with self.stats.time("write"):
+            self._save()
+
+    def abort(self):
+        """Give up on the output: close it, and remove it unless it is the source itself."""
+        self.output_document.close()
+        if os.path.abspath(self.pdf_path) != os.path.abspath(self.output_path):
+            os.remove(self.output_path)
+
+    def _save(self):
+        try:
+            subset = self.page_nums is not None and len(self.page_nums) != self.output_document.page_count
+            if subset:
+                self.output_document.select(self.page_nums)
+            if not subset and self.output_document.can_save_incrementally():
+                self.output_document.saveIncr()
+            else:
+                # Repaired or encrypted files cannot take an incremental update, and a page
+                # subset needs the dropped pages' objects garbage collected
+                temp_path = self.output_path + ".tmp"
+                self.output_document.save(temp_path, garbage=1 if subset else 0)
+                self.output_document.close()
+                os.replace(temp_path, self.output_path)
+        finally:
+            if not self.output_document.is_closed:
+                self.output_document.close()
+
+class OcrPdfWriter:
+    """Stitch Tesseract PDF pages together, scaled to the original page sizes.
+
+    Pages that were not OCRed (text and blank pages) are copied from the source unchanged,
+    read from source, the pdf_path SourceFile, when one is given. The whole document is
+    built in memory with pypdf and written on close().
+    """
+
+    def __init__(self, pdf_path, pdf_document, output_path, stats=NULL_STATS, source=None):
+        self.pdf_path = pdf_path
+        self.source = source
+        self.pdf_document = pdf_document
+        self.output_path = output_path
+        self.stats = stats
+        self.source_reader = None
+        self.pdf_writer = PdfWriter()
+
+    def source_page(self, page_num):
+        if self.source_reader is None:
+            self.source_reader = PdfReader(self.source.open_stream() if self.source else self.pdf_path)
+        return self.source_reader.pages[page_num]
+
+    def add(self, page_num, ocr_result):
+        if not ocr_result:
+            return
+        if ocr_result["status"] != "ocr":
+            with self.stats.time("copy"):
+                self.pdf_writer.add_page(self.source_page(page_num))
+            return
+        with self.stats.time("parse"):
+            page = PdfReader(io.BytesIO(ocr_result["pdf"])).pages[0]
+        with self.stats.time("scale"):
+            original_page = self.pdf_document.load_page(page_num)
+            page.scale_to(*ocr_page_size(original_page, ocr_result))
+            self.pdf_writer.add_page(page)
+
+    def close(self):
+        with self.stats.time("write"):
+            with open(self.output_path, 'wb') as f_out:
+                self.pdf_writer.write(f_out)
+
+    def abort(self):
+        """Give up on the output; nothing has been written yet."""
+        self.pdf_writer = None
+
+class StreamingOcrPdfWriter(OcrPdfWriter):
+    """OcrPdfWriter that writes each page to disk as soon as it is added.
+
+    Output goes to a ".part" file that replaces output_path on close(), so converting a
+    file in place never overwrites the source while it is still being read.
+    """
+
+    def __init__(self, pdf_path, pdf_document, output_path, stats=NULL_STATS, source=None):
+        super().__init__(pdf_path, pdf_document, output_path, stats, source)
+        self.part_path = output_path + ".part"
+        self.pdf_writer = StreamingPdfWriter(self.part_path)
+
+    def add(self, page_num, ocr_result):
+        if not ocr_result:
+            return
+        if ocr_result["status"] != "ocr":
+            with self.stats.time("copy"):
+                self.pdf_writer.add_page(self.source_page(page_num))
+            return
+        with self.stats.time("parse"):
+            page = PdfReader(io.BytesIO(ocr_result["pdf"])).pages[0]
+        # Scaling happens as the page is written
+        with self.stats.time("write"):
+            original_page = self.pdf_document.load_page(page_num)
+            self.pdf_writer.add_page(page, *ocr_page_size(original_page, ocr_result))
+
+    def close(self):
+        with self.stats.time("write"):
+            self.pdf_writer.close()
+            os.replace(self.part_path, self.output_path)
+
+    def abort(self):
+        """Give up on the output and remove the partly written ".part" file."""
+        self.pdf_writer.file.close()
+        os.remove(self.part_path)
+
+def page_report(page_num, ocr_result):
+    """The per-page report entry for a result, without its OCR payload."""
+    page_report = {"page": page_num, "status": ocr_result["status"] if ocr_result else "failed"}
+    if ocr_result and "error" in ocr_result:
+        page_report["error"] = ocr_result["error"]
+    if ocr_result and ocr_result["status"] == "ocr":
+        page_report["cache_hit"] = ocr_result["cache_hit"]
+        page_report["dpi"] = ocr_result["dpi"]
+        page_report["rotation"] = ocr_result.get("rotation", 0)
+        if "confidence" in ocr_result:
+            page_report["confidence"] = ocr_result["confidence"]
+            page_report["passes"] = ocr_result["passes"]
+    if ocr_result and ocr_result.get("stats"):
+        page_report["seconds"] = {stage: entry["seconds"] for stage, entry in ocr_result["stats"]["stages"].items()}
+    return page_report
+
+def build_report(page_reports):
+    """Summarise per-page entries into the report returned by convert_scanned_pdf_to_ocr."""
+    report = {"page_count": len(page_reports), "pages": page_reports}
+    for status in ("ocr", "text", "blank", "failed"):
+        report[f"{status}_pages"] = sum(1 for page_report in page_reports if page_report["status"] == status)
+    report["cache_hits"] = sum(1 for page_report in page_reports if page_report.get("cache_hit"))
+    report["cache_misses"] = report["ocr_pages"] - report["cache_hits"]
+    report["rotated_pages"] = sum(1 for page_report in page_reports if page_report.get("rotation"))
+    report["reocr_pages"] = sum(1 for page_report in page_reports if page_report.get("passes", 1) > 1)
+    return report
+
+def build_options(dpi=DEFAULT_DPI, engine=None, output_mode="pdf", native_images=True, skip_text_pages=True,
+                  ocr_cache=DEFAULT_CACHE_DIR, colorspace=None, min_confidence=None, reocr_dpi=REOCR_DPI,
+                  reocr_psm=None, auto_rotate=False, blank_threshold=BLANK_THRESHOLD, page_timeout=PAGE_TIMEOUT,
+                  page_retries=PAGE_RETRIES, max_memory=None, stats=False, sidecars=()):
+    """Validate conversion settings and return the per-page options dict handed to workers.
+
+    See convert_scanned_pdf_to_ocr for what each setting does.
+    """
+    if output_mode not in OUTPUT_MODES:
+        raise ValueError(f"Unknown output mode: {output_mode}")
+    if colorspace is None:
+        colorspace = "gray" if output_mode == "overlay" else "rgb"
+    if colorspace not in ("gray", "rgb"):
+        raise ValueError(f"Unknown colorspace: {colorspace}")
+    if dpi != "auto" and not (isinstance(dpi, (int, float)) and dpi > 0):
+        raise ValueError(f"dpi must be a positive number or 'auto', not {dpi!r}")
+    if min_confidence is not None and not 0 <= min_confidence <= 100:
+        raise ValueError(f"min_confidence must be between 0 and 100, not {min_confidence!r}")
+    unknown = set(sidecars or ()) - set(SIDECAR_FORMATS)
+    if unknown:
+        raise ValueError(f"Unknown sidecar formats: {', '.join(sorted(unknown))}")
+    return {"dpi": dpi, "engine": engine, "output_mode": output_mode, "native_images": native_images,
+            "skip_text_pages": skip_text_pages, "ocr_cache": ocr_cache, "colorspace": colorspace,
+            "min_confidence": min_confidence, "reocr_dpi": reocr_dpi, "reocr_psm": reocr_psm,
+            "auto_rotate": auto_rotate, "blank_threshold": blank_threshold, "page_timeout": page_timeout,
+            "page_retries": page_retries, "max_memory": max_memory, "stats": stats,
+            "sidecars": tuple(sidecars or ())}
+
+def open_writer(pdf_path, pdf_document, output_path, options, streaming=False, page_nums=None, stats=NULL_STATS,
+                source=None):
+    """Return the page writer for options["output_mode"]; see the writer classes above.
+
+    source is pdf_path's SourceFile, for the writer to read the source from. It is not
+    used to write over the source itself: the output would replace the mapped file.
+    """
+    if os.path.abspath(pdf_path) == os.path.abspath(output_path):
+        source = None
+    if options["output_mode"] == "overlay":
+        return TextLayerWriter(pdf_path, output_path, page_nums, stats, source)
+    if streaming:
+        return StreamingOcrPdfWriter(pdf_path, pdf_document, output_path, stats, source)
+    return OcrPdfWriter(pdf_path, pdf_document, output_path, stats, source)
+
+def open_journal(pdf_path, output_path, options, start, stop):
+    """Open (or resume) the conversion journal for converting pages start..stop-1."""
+    # Collecting stats does not change the output, so it does not invalidate a journal
+    job = {"source": os.path.abspath(pdf_path), "fingerprint": file_fingerprint(pdf_path),
+           "options": {key: value for key, value in options.items() if key != "stats"}, "page_range": [start, stop]}
+    return ConversionJournal(output_path, job)
+
+def convert_scanned_pdf_to_ocr(pdf_path, *args, dpi=DEFAULT_DPI, workers=None, backend="thread", engine=None,
+                               output_mode="pdf", native_images=True, skip_text_pages=True,
+                               ocr_cache=DEFAULT_CACHE_DIR, window=None, colorspace=None, journal=False,
+                               page_range=None, optimize=False, min_confidence=None, reocr_dpi=REOCR_DPI,
+                               reocr_psm=None, auto_rotate=False, blank_threshold=BLANK_THRESHOLD,
+                               page_timeout=PAGE_TIMEOUT, page_retries=PAGE_RETRIES, max_memory=None, stats=False,
+                               stats_sink=None, cancel=None, progress=None, sidecars=(), render_workers=None,
+                               linearize=False):
+    """OCR every page of pdf_path into a searchable PDF.
+
+    backend="thread" shares one document between threads; backend="process" gives each
+    worker process its own document handle so rendering and OCR scale across cores.
+    workers defaults to the executor's own default for threads and os.cpu_count() for
+    processes. backend="pipeline" splits the work into stages (see page_pipeline):
+    render_workers processes classify and render pages and workers processes OCR them,
+    handing page images over through shared memory and bounded queues, so the CPU-bound
+    and OCR-bound halves can be sized separately. engine picks the OCR engine (see
+    ocr_engine.get_engine); each worker keeps its own resident engine.
+    output_mode="overlay" keeps the original pages untouched and adds an invisible text
+    layer instead of replacing them with Tesseract's PDF pages. native_images OCRs
+    single-image scanned pages straight from the embedded image at its native resolution;
+    other pages are rendered at dpi. dpi="auto" picks the resolution per page from the
+    size of its text (see probe_page_dpi) and records it in the report. colorspace ("gray"
+    or "rgb") is what rendered pages are rasterised in; it defaults to gray for overlay
+    output, where the render only feeds OCR, and to rgb for pdf output, where the render
+    becomes the output page. skip_text_pages copies pages that already carry a text layer
+    through unchanged and only OCRs scanned ones. ocr_cache is the directory of the
+    content-addressed OCR cache (None disables it), so pages seen before are not
+    recognised again.
+
+    window turns on streaming assembly: at most window pages are in flight, and each page
+    is written to disk as soon as every page before it is done, so memory stays bounded by
+    the window rather than the page count. Keep it at least workers x PROCESS_CHUNK_PAGES
+    for the process backend or workers will sit idle. The pipeline backend always streams;
+    window bounds its pages between rendering and writing.
+
+    journal=True checkpoints every finished page in a sidecar journal next to the output
+    (see conversion_journal); rerunning an interrupted conversion with the same arguments
+    resumes where it stopped, and the journal is removed once the output is written.
+
+    page_range=(start, stop) converts only pages start <= page < stop (zero-based) and
+    writes just those pages to output_path, so a huge document can be converted as shards
+    on several workers and stitched back together with merge_shards().
+
+    min_confidence turns on selective re-OCR: every page is scored by its mean Tesseract
+    word confidence, and pages scoring below it are OCRed a second time at reocr_dpi (and
+    with reocr_psm if given). Pair it with a cheap dpi so only the hard pages pay for a
+    fine render; each page's confidence and pass count go into the report.
+
+    blank_threshold skips OCR for blank and near-blank scanned pages, which are copied
+    through like text pages: a page counts as blank when the share of ink and of edge
+    pixels on a thumbnail stays within it (see is_blank_page). None OCRs every page.
+
+    page_timeout (seconds, None for no limit) bounds every OCR call on a page, and a page
+    that fails is retried page_retries times before it is passed through un-OCRed with
+    status "failed" and its error in the report. A worker that hangs anyway is given up on
+    after stall_timeout. max_memory caps each worker process's address space in bytes
+    (process backend, POSIX only), turning a ballooning page into a failed one.
+
+    auto_rotate=True detects each scanned page's orientation on a thumbnail before OCR and
+    turns sideways or upside-down pages upright (see detect_rotation); pdf output pages
+    come out upright, overlay pages keep their look with the text layer turned to match.
+
+    optimize=True recompresses the page images of the finished output to suit their
+    content (see pdf_optimize.optimize_pdf) and adds its sizes to the report as
+    "optimize". linearize=True then rewrites the output for fast web view, so viewers
+    fetching it over HTTP range requests can show page 1 before the rest arrives:
+    linearized, packed into object streams, with the font repeated on every Tesseract page
+    merged into one copy (see pdf_optimize.linearize_pdf); its sizes go into the report as
+    "linearize". It needs pikepdf, or a PyMuPDF that can still linearize; RuntimeError is
+    raised up front when neither is there.
+
+    stats=True instruments the conversion: the report gains "stats", with the seconds and
+    calls spent in each stage (open, classify, render, osd, rotate, cache, ocr, parse,
+    scale, copy, overlay, write, optimize, linearize, sidecars) and counters for pages,
+    bytes in and out and cache hits, and every page entry gains its own stage "seconds".
+    stats_sink, a path, also sends the stats to a JSON lines file or, for a ".prom" path,
+    a Prometheus textfile (see conversion_stats.write_stats); it implies stats=True.
+
+    sidecars lists text sidecars to write next to the output (see ocr_sidecars): "txt" for
+    the plain text, pages separated by form feeds, and "hocr" and/or "alto" for the words
+    with their boxes. They are built from the OCR results as pages are written, so search
+    and extraction can read them instead of parsing the PDF; the report lists them under
+    "sidecars".
+
+    cancel is a cancel token, a threading.Event or (for the process backend, whose workers
+    can only see that kind) a multiprocessing.Event. It is checked between pages and
+    before every OCR call; once set, the workers stop, the partial output and journal are
+    removed and ConversionCancelled is raised. progress(done, total, stage) is called as
+    each page is written, with stage "ocr", and again on entering the "write", "optimize"
+    and "linearize" stages. conversion_jobs.start_conversion wraps both into a job handle.
+
+    Returns a report dict with a status and OCR dpi per page ("ocr", "text", "blank" or
+    "failed"), totals and OCR cache hits and misses.
+    """
     if args:
         output_path=args[0]
     else:
         output_path=pdf_path
-    pdf_document = fitz.open(pdf_path)
-    pdf_writer = PdfWriter()
-
-    # Use a list to store processed pages
-    pages = [None] * pdf_document.page_count
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {executor.submit(process_page, page_num, pdf_document, dpi): page_num for page_num in range(pdf_document.page_count)}
-        for future in concurrent.futures.as_completed(futures):
-            page_num, ocr_pdf_page = future.result()
-            if ocr_pdf_page:
-                # Store the page in the correct position
-                pages[page_num] = ocr_pdf_page
-
-    # Add pages in the correct order with the correct size
-    for page_num, page in enumerate(pages):
-        if page:
-            original_page = pdf_document.load_page(page_num)
-            page.scale_to(original_page.rect.width, original_page.rect.height)
-            pdf_writer.add_page(page)
-   
-    with open(output_path, 'wb') as f_out:
-        pdf_writer.write(f_out)
+    if backend not in ("thread", "process", "pipeline"):
+        raise ValueError(f"Unknown backend: {backend}")
+    if linearize:
+        check_linearize()
+    if backend == "pipeline" and os.name != "posix":
+        # Frames are shared memory blocks that outlive their creator's handle, which only
+        # POSIX shared memory does
+        raise ValueError('backend="pipeline" needs a POSIX system; use backend="process" here')
+    options = build_options(dpi=dpi, engine=engine, output_mode=output_mode, native_images=native_images,
+                            skip_text_pages=skip_text_pages, ocr_cache=ocr_cache, colorspace=colorspace,
+                            min_confidence=min_confidence, reocr_dpi=reocr_dpi, reocr_psm=reocr_psm,
+                            auto_rotate=auto_rotate, blank_threshold=blank_threshold, page_timeout=page_timeout,
+                            page_retries=page_retries, max_memory=max_memory, stats=bool(stats or stats_sink),
+                            sidecars=sidecars)
+    conversion_stats = ConversionStats() if options["stats"] else NULL_STATS
+    with conversion_stats.time("open"):
+        # The source is mapped once for the document, the journal's fingerprint and the
+        # writer (see source_files); process workers open it by path themselves
+        source = open_source(pdf_path)
+        try:
+            pdf_document = source.open_pdf()
+        except BaseException:
+            source.close()
+            raise
+    conversion_stats.count("bytes_in", source.size)
+    in_place = os.path.abspath(pdf_path) == os.path.abspath(output_path)
+    page_count = pdf_document.page_count
+    start, stop = page_range or (0, page_count)
+    if not 0 <= start < stop <= page_count:
+        pdf_document.close()
+        source.close()
+        raise ValueError(f"page_range {page_range} is outside the document's {page_count} pages")
+    selected_pages = list(range(start, stop))
+
+    conversion_journal = None
+    page_nums = selected_pages
+    if journal:
+        conversion_journal = open_journal(pdf_path, output_path, options, start, stop)
+        page_nums = [page_num for page_num in page_nums if page_num not in conversion_journal.completed]
+
+    writer = open_writer(pdf_path, pdf_document, output_path, options, streaming=bool(window) or backend == "pipeline",
+                         page_nums=selected_pages if page_range else None, stats=conversion_stats, source=source)
+    sidecar_writer = open_sidecars(output_path, options["sidecars"])
+
+    # Results arrive in page order, so each one goes straight to the writer
+    fresh_results = iter_page_results(pdf_path, pdf_document, page_nums, backend, workers, options, window, cancel,
+                                      render_workers)
+    results = fresh_results
+    if conversion_journal:
+        results = iter_journaled_results(conversion_journal, results, selected_pages)
+    page_reports = []
+    try:
+        if progress:
+            progress(0, len(selected_pages), "ocr")
+        for page_num, ocr_result in results:
+            check_cancelled(cancel)
+            page_reports.append(page_report(page_num, ocr_result))
+            merge_page_stats(conversion_stats, ocr_result)
+            writer.add(page_num, ocr_result)
+            if sidecar_writer:
+                with conversion_stats.time("sidecars"):
+                    sidecar_writer.add(page_num, ocr_result, pdf_document)
+            if progress:
+                progress(len(page_reports), len(selected_pages), "ocr")
+        check_cancelled(cancel)
+    except BaseException as e:
+        # Stop the workers now rather than when the generators are collected
+        fresh_results.close()
+        pdf_document.close()
+        writer.abort()
+        source.close()
+        if sidecar_writer:
+            sidecar_writer.abort()
+        if conversion_journal:
+            if isinstance(e, ConversionCancelled):
+                conversion_journal.finish()
+            else:
+                conversion_journal.close()
+        raise
+
+    if progress:
+        progress(len(page_reports), len(selected_pages), "write")
+    pdf_document.close()
+    if in_place:
+        # The output replaces the source, so it must not be mapped any more
+        source.close()
+    writer.close()
+    if not in_place:
+        source.close()
+    if conversion_journal:
+        conversion_journal.finish()
+    report = build_report(page_reports)
+    if optimize:
+        if progress:
+            progress(len(page_reports), len(selected_pages), "optimize")
+        with conversion_stats.time("optimize"):
+            report["optimize"] = optimize_pdf(output_path)
+    if linearize:
+        if progress:
+            progress(len(page_reports), len(selected_pages), "linearize")
+        with conversion_stats.time("linearize"):
+            report["linearize"] = linearize_pdf(output_path)
+    if sidecar_writer:
+        # Last, so the sidecars are never older than the output they describe
+        report["sidecars"] = sidecar_writer.close()
+    if conversion_stats.enabled:
+        conversion_stats.count("bytes_out", os.path.getsize(output_path))
+        report["stats"] = conversion_stats.as_dict()
+        write_stats(stats_sink, report["stats"], document=os.path.abspath(pdf_path), output=os.path.abspath(output_path))
+    return report
+
+def merge_shards(shard_paths, output_path):
+    """Concatenate shard PDFs written with page_range=, in the given order, into output_path.
+
+    Identical objects across shards (Tesseract's font, for one) are stored only once.
+    """
+    merged_document = fitz.open()
+    try:
+        for shard_path in shard_paths:
+            with fitz.open(shard_path) as shard_document:
+                merged_document.insert_pdf(shard_document)
+        merged_document.save(output_path, garbage=3, deflate=True)
+    finally:
+        merged_document.close()
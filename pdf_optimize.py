@@ -0,0 +1,216 @@
+import io
+import os
+import logging
+import fitz  # PyMuPDF
+import numpy as np
+from PIL import Image
+try:
+    import pikepdf
+except ImportError:  # optional; without it linearize_pdf needs a PyMuPDF that still linearizes
+    pikepdf = None
+
+LOGGER = logging.getLogger(__name__)
+
+# JPEG quality for grayscale and colour page images
+JPEG_QUALITY = 75
+
+# Grayscale and colour images are downsampled to at most these resolutions
+MAX_GRAY_DPI = 200
+MAX_COLOR_DPI = 150
+
+# Classification thresholds, measured on a small nearest-neighbour sample of the pixels
+# (a smoothing downscale would turn the edges of 1-bit text into midtones): a pixel is
+# coloured when its channels differ by more than COLOR_SPREAD, and an image is bitonal
+# when fewer than BITONAL_MIDTONES of its pixels are neither near-black nor near-white
+THUMBNAIL_SIZE = 256
+COLOR_SPREAD = 24
+COLOR_PIXELS = 0.01
+BITONAL_MIDTONES = 0.02
+
+
+def classify_image(img):
+    """Classify a PIL image as "bitonal", "gray" or "color"."""
+    scale = min(1, THUMBNAIL_SIZE / max(img.size))
+    thumb = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.NEAREST)
+    pixels = np.asarray(thumb.convert("RGB"), dtype=np.int16)
+    spread = pixels.max(axis=2) - pixels.min(axis=2)
+    if (spread > COLOR_SPREAD).mean() > COLOR_PIXELS:
+        return "color"
+    gray = pixels.mean(axis=2)
+    midtones = ((gray > 48) & (gray < 208)).mean()
+    return "bitonal" if midtones < BITONAL_MIDTONES else "gray"
+
+def encode_bitonal(img):
+    """Return (raw CCITT G4 data, decode params) for img thresholded to 1 bit."""
+    bitonal = img.convert("L").point(lambda value: 255 if value > 128 else 0, mode="1")
+    buffer = io.BytesIO()
+    # One strip holding the whole image, so the strip is exactly the G4 stream a PDF needs
+    bitonal.save(buffer, format="TIFF", compression="group4", tiffinfo={278: bitonal.height})
+    tiff = Image.open(buffer)
+    offset, length = tiff.tag_v2[273][0], tiff.tag_v2[279][0]
+    # With min-is-black photometrics (PIL's default) white and black codes are swapped
+    black_is_1 = "true" if tiff.tag_v2.get(262) == 1 else "false"
+    data = buffer.getvalue()[offset:offset + length]
+    return data, f"<</K -1/Columns {bitonal.width}/Rows {bitonal.height}/BlackIs1 {black_is_1}>>"
+
+def encode_jpeg(img, max_dpi, dpi):
+    """Return JPEG data for img, downsampled to max_dpi when it is finer than that."""
+    if dpi > max_dpi:
+        scale = max_dpi / dpi
+        img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return img, buffer.getvalue()
+
+def image_dpis(pdf_document):
+    """Map each image xref to the highest resolution at which it is placed on any page,
+    in one pass over the document."""
+    dpis = {}
+    for page in pdf_document:
+        for info in page.get_image_info(xrefs=True):
+            placed_width = fitz.Rect(info["bbox"]).width
+            if info["xref"] and placed_width:
+                dpis[info["xref"]] = max(dpis.get(info["xref"], 0), info["width"] * 72 / placed_width)
+    return dpis
+
+def load_image(pdf_document, xref):
+    """Return (PIL image, class) for an image XObject, or None for one that is left alone.
+
+    1-bit grayscale images and stencil masks are bitonal as they stand; anything else is
+    classified from its pixels. A stencil mask comes back black where it paints.
+    """
+    if pdf_document.xref_get_key(xref, "SMask")[0] != "null" or pdf_document.xref_get_key(xref, "Mask")[0] != "null":
+        return None
+    image_mask = pdf_document.xref_get_key(xref, "ImageMask")[1] == "true"
+    pix = fitz.Pixmap(pdf_document, xref)
+    if image_mask:
+        # A stencil's pixmap is its coverage alone, 255 where it paints
+        img = Image.frombytes("L", (pix.width, pix.height), pix.samples).point(lambda value: 255 - value)
+        return img, "bitonal"
+    if pix.alpha:
+        return None
+    if pix.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    img = Image.frombytes("L" if pix.n == 1 else "RGB", (pix.width, pix.height), pix.samples)
+    if pix.n == 1 and pdf_document.xref_get_key(xref, "BitsPerComponent")[1] == "1":
+        return img, "bitonal"
+    return img, classify_image(img)
+
+def recompress_image(pdf_document, xref, dpi=0):
+    """Re-encode one image XObject to suit its content; returns its class or None if kept.
+
+    dpi is the highest resolution the image is placed at (see image_dpis); images finer
+    than their class's limit are downsampled to it.
+    """
+    loaded = load_image(pdf_document, xref)
+    if loaded is None:
+        return None
+    img, kind = loaded
+
+    if kind == "bitonal":
+        data, decode_parms = encode_bitonal(img)
+        keys = {"Filter": "/CCITTFaxDecode", "DecodeParms": decode_parms, "ColorSpace": "/DeviceGray",
+                "BitsPerComponent": "1", "Width": str(img.width), "Height": str(img.height)}
+        if pdf_document.xref_get_key(xref, "ImageMask")[1] == "true":
+            # Still a stencil, painting its black (0) samples; stencils have no colour space
+            keys["ColorSpace"] = "null"
+    else:
+        if kind == "gray":
+            img, data = encode_jpeg(img.convert("L"), MAX_GRAY_DPI, dpi)
+        else:
+            img, data = encode_jpeg(img, MAX_COLOR_DPI, dpi)
+        keys = {"Filter": "/DCTDecode", "DecodeParms": "null",
+                "ColorSpace": "/DeviceGray" if img.mode == "L" else "/DeviceRGB",
+                "BitsPerComponent": "8", "Width": str(img.width), "Height": str(img.height)}
+
+    if len(data) >= len(pdf_document.xref_stream_raw(xref)):
+        return None
+    pdf_document.update_stream(xref, data, compress=False)
+    for key, value in keys.items():
+        pdf_document.xref_set_key(xref, key, value)
+    # The new encoding already holds the final pixel values
+    pdf_document.xref_set_key(xref, "Decode", "null")
+    pdf_document.xref_set_key(xref, "Intent", "null")
+    return kind
+
+def optimize_pdf(pdf_path, output_path=None):
+    """Recompress page images in place (or into output_path), keeping text layers intact.
+
+    Bitonal images become CCITT G4, grayscale images grayscale JPEG and colour images
+    downsampled JPEG; an image only changes when its new encoding is smaller. Returns a
+    dict with the file size before and after and how many images of each class changed.
+    """
+    output_path = output_path or pdf_path
+    stats = {"bytes_before": os.path.getsize(pdf_path), "bitonal": 0, "gray": 0, "color": 0, "kept": 0}
+    pdf_document = fitz.open(pdf_path)
+    try:
+        xrefs = sorted({img[0] for page in pdf_document for img in page.get_images(full=True)})
+        dpis = image_dpis(pdf_document)
+        for xref in xrefs:
+            try:
+                kind = recompress_image(pdf_document, xref, dpis.get(xref, 0))
+            except Exception as e:
+                LOGGER.warning(f"Keeping image {xref} of {os.path.basename(pdf_path)} as is - {e}")
+                kind = None
+            stats[kind or "kept"] += 1
+        temp_path = output_path + ".tmp"
+        pdf_document.save(temp_path, garbage=3, deflate=True)
+    finally:
+        pdf_document.close()
+    os.replace(temp_path, output_path)
+    stats["bytes_after"] = os.path.getsize(output_path)
+    LOGGER.info(f"Optimized {os.path.basename(output_path)}: {stats['bytes_before']} -> {stats['bytes_after']} bytes")
+    return stats
+
+def check_linearize():
+    """Raise RuntimeError unless linearize_pdf can work here, so callers can refuse
+    linearize=True before converting anything rather than fail at the end."""
+    if pikepdf is not None:
+        return
+    try:
+        with fitz.open() as pdf_document:
+            pdf_document.new_page()
+            pdf_document.tobytes(linear=True)
+    except Exception as e:  # MuPDF dropped linearisation in 1.26
+        raise RuntimeError(f"Linearizing needs pikepdf (pip install pikepdf); this PyMuPDF cannot - {e}") from e
+
+def linearize_pdf(pdf_path, output_path=None):
+    """Rewrite a PDF in place (or into output_path) for fast web view.
+
+    Duplicate objects are merged first, which collapses the copy of the same font that
+    every Tesseract page embeds into one, and streams are deflated. The file is then
+    linearized with object streams by pikepdf (qpdf) when it is installed, or else by
+    PyMuPDF where its MuPDF still can; RuntimeError is raised, leaving the file as it
+    was, when neither can. Returns a dict with the file size before and after and
+    "linearized" (always True).
+    """
+    output_path = output_path or pdf_path
+    stats = {"bytes_before": os.path.getsize(pdf_path), "linearized": False}
+    temp_path = output_path + ".tmp"
+    pdf_document = fitz.open(pdf_path)
+    try:
+        if pikepdf is not None:
+            merged_path = output_path + ".merged.tmp"
+            pdf_document.save(merged_path, garbage=4, deflate=True)
+        else:
+            try:
+                pdf_document.save(temp_path, garbage=4, deflate=True, linear=True)
+                stats["linearized"] = True
+            except Exception as e:  # MuPDF dropped linearisation in 1.26
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise RuntimeError(f"Cannot linearize {os.path.basename(pdf_path)}: it needs pikepdf "
+                                   f"(pip install pikepdf) with this PyMuPDF - {e}") from e
+    finally:
+        pdf_document.close()
+    if pikepdf is not None:
+        try:
+            with pikepdf.open(merged_path) as pdf:
+                pdf.save(temp_path, linearize=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+        finally:
+            os.remove(merged_path)
+        stats["linearized"] = True
+    os.replace(temp_path, output_path)
+    stats["bytes_after"] = os.path.getsize(output_path)
+    LOGGER.info(f"Linearized {os.path.basename(output_path)}: {stats['bytes_before']} -> {stats['bytes_after']} bytes")
+    return stats
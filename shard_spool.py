@@ -0,0 +1,232 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import argparse
+import threading
+import logging
+import fitz  # PyMuPDF
+from pdf_conversion import convert_scanned_pdf_to_ocr, merge_shards
+from conversion_journal import JOURNAL_SUFFIX
+
+logging.basicConfig(level=logging.INFO)
+LOGGER = logging.getLogger(__name__)
+
+# Pages per shard unless the plan asks for another size
+DEFAULT_SHARD_PAGES = 200
+
+# Seconds between spool scans for idle workers and waiting merges
+POLL_INTERVAL = 5
+
+# Seconds the merge waits for a job's shards before giving up
+MERGE_TIMEOUT = 24 * 60 * 60
+
+# A claim is a lease: its worker touches the claimed file every HEARTBEAT_INTERVAL
+# seconds, and a claim untouched for LEASE_SECONDS is taken to belong to a dead worker
+# and goes back to jobs/. Hosts sharing a spool need clocks that agree well within that.
+HEARTBEAT_INTERVAL = 30
+LEASE_SECONDS = 4 * HEARTBEAT_INTERVAL
+
+# Shard jobs move jobs/ -> claimed/ -> done/ (or failed/); a rename is the claim, so any
+# number of workers on any hosts sharing the spool directory can take part
+SPOOL_DIRS = ("jobs", "claimed", "done", "failed", "shards")
+
+
+def _spool_path(spool_dir, *parts):
+    return os.path.join(spool_dir, *parts)
+
+def plan_shards(pdf_path, spool_dir, output_path, shard_pages=DEFAULT_SHARD_PAGES, **options):
+    """Split a conversion into page-range shard jobs in spool_dir and return the job id.
+
+    options are passed on to convert_scanned_pdf_to_ocr by whichever worker runs a shard,
+    so they must be JSON serialisable. pdf_path must be reachable from every worker host.
+    """
+    for name in SPOOL_DIRS:
+        os.makedirs(_spool_path(spool_dir, name), exist_ok=True)
+    with fitz.open(pdf_path) as pdf_document:
+        page_count = pdf_document.page_count
+    job_id = f"{os.path.splitext(os.path.basename(pdf_path))[0]}-{uuid.uuid4().hex[:8]}"
+    shards = []
+    for start in range(0, page_count, shard_pages):
+        stop = min(start + shard_pages, page_count)
+        shard_name = f"{job_id}-{start:06d}"
+        shard = {
+            "source": os.path.abspath(pdf_path),
+            "page_range": [start, stop],
+            "output": os.path.abspath(_spool_path(spool_dir, "shards", shard_name + ".pdf")),
+            "options": options,
+        }
+        with open(_spool_path(spool_dir, "jobs", shard_name + ".json"), 'w') as f:
+            json.dump(shard, f)
+        shards.append(shard_name)
+    plan = {"source": os.path.abspath(pdf_path), "output": os.path.abspath(output_path), "shards": shards}
+    with open(_spool_path(spool_dir, job_id + ".plan.json"), 'w') as f:
+        json.dump(plan, f, indent=4)
+    LOGGER.info(f"Planned {len(shards)} shards for {pdf_path} as job {job_id}")
+    return job_id
+
+def requeue_stale_claims(spool_dir):
+    """Move claims whose lease has run out back to jobs/; returns the shard files moved."""
+    requeued = []
+    for claimed_file in os.listdir(_spool_path(spool_dir, "claimed")):
+        claimed_path = _spool_path(spool_dir, "claimed", claimed_file)
+        job_file = claimed_file.split("@")[0]
+        try:
+            if time.time() - os.path.getmtime(claimed_path) < LEASE_SECONDS:
+                continue
+            os.rename(claimed_path, _spool_path(spool_dir, "jobs", job_file))
+        except OSError:
+            continue  # finished, or requeued by someone else, meanwhile
+        LOGGER.warning(f"Claim {claimed_file} expired; shard {job_file} is queued again")
+        requeued.append(job_file)
+    return requeued
+
+def claim_shard(spool_dir):
+    """Atomically claim one queued shard; returns (claimed_path, shard) or None.
+
+    Expired claims are put back in the queue first, so shards of dead workers are taken
+    up again.
+    """
+    requeue_stale_claims(spool_dir)
+    worker_tag = f"{socket.gethostname()}-{os.getpid()}"
+    for job_file in sorted(os.listdir(_spool_path(spool_dir, "jobs"))):
+        claimed_path = _spool_path(spool_dir, "claimed", f"{job_file}@{worker_tag}")
+        try:
+            os.rename(_spool_path(spool_dir, "jobs", job_file), claimed_path)
+            # A rename keeps the queued file's mtime, so start the lease now
+            os.utime(claimed_path)
+            with open(claimed_path) as f:
+                return claimed_path, json.load(f)
+        except OSError:
+            continue  # another worker got there first, or requeued the claim meanwhile
+    return None
+
+def _renew_lease(claimed_path, stop):
+    """Heartbeat thread: touch the claim until stop is set or the claim is gone."""
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            os.utime(claimed_path)
+        except OSError:
+            LOGGER.warning(f"Lost the claim on {os.path.basename(claimed_path)}; it has been queued again")
+            return
+
+def run_worker(spool_dir, once=False):
+    """Convert queued shards until the spool is empty (once=True) or forever."""
+    while True:
+        claimed = claim_shard(spool_dir)
+        if claimed is None:
+            if once:
+                return
+            time.sleep(POLL_INTERVAL)
+            continue
+        claimed_path, shard = claimed
+        shard_file, worker_tag = os.path.basename(claimed_path).split("@")
+        # A shard requeued while this worker still runs it gets a second worker, so each
+        # claim converts into its own file (and journal) and only a holder publishes it
+        claim_output = f"{shard['output']}.{worker_tag}.tmp"
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=_renew_lease, args=(claimed_path, stop_heartbeat), daemon=True)
+        heartbeat.start()
+        try:
+            LOGGER.info(f"Converting shard {shard_file}: pages {shard['page_range']}")
+            convert_scanned_pdf_to_ocr(shard["source"], claim_output, page_range=tuple(shard["page_range"]),
+                                       journal=True, **shard["options"])
+            outcome = "done"
+        except Exception as e:
+            LOGGER.error(f"Shard {shard_file} failed: {e}")
+            outcome = "failed"
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+        if not os.path.exists(claimed_path):
+            # The lease ran out and another worker has the shard now; its result counts
+            LOGGER.warning(f"Shard {shard_file} was requeued while it ran; leaving it to its new worker")
+            _discard(claim_output)
+            continue
+        if outcome == "done":
+            # Complete either way, so a claim lost from here on still leaves a whole shard
+            os.replace(claim_output, shard["output"])
+        else:
+            _discard(claim_output)
+        try:
+            os.replace(claimed_path, _spool_path(spool_dir, outcome, shard_file))
+        except OSError:
+            LOGGER.warning(f"Shard {shard_file} was requeued as it finished; leaving it to its new worker")
+
+def _discard(claim_output):
+    """Remove a claim's unpublished output and its journal; no other claim resumes them."""
+    journal_path = claim_output + JOURNAL_SUFFIX
+    for path in (claim_output, journal_path, journal_path + "-wal", journal_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def merge_plan(spool_dir, job_id, wait=True, timeout=MERGE_TIMEOUT):
+    """Stitch a job's shards into its output once every shard is done, then clean up.
+
+    With wait, waits up to timeout seconds (None for no limit) for the shards, putting
+    expired claims back in the queue meanwhile, and raises TimeoutError after that.
+    """
+    plan_path = _spool_path(spool_dir, job_id + ".plan.json")
+    with open(plan_path) as f:
+        plan = json.load(f)
+    shard_files = [shard_name + ".json" for shard_name in plan["shards"]]
+    deadline = timeout and time.monotonic() + timeout
+    while True:
+        failed = [name for name in shard_files if os.path.exists(_spool_path(spool_dir, "failed", name))]
+        if failed:
+            raise RuntimeError(f"Shards failed for job {job_id}: {', '.join(failed)}")
+        remaining = [name for name in shard_files if not os.path.exists(_spool_path(spool_dir, "done", name))]
+        if not remaining:
+            break
+        if not wait:
+            raise RuntimeError(f"{len(remaining)} shards of job {job_id} are not done yet")
+        if deadline and time.monotonic() > deadline:
+            raise TimeoutError(f"{len(remaining)} shards of job {job_id} were not done within {timeout}s")
+        requeue_stale_claims(spool_dir)
+        time.sleep(POLL_INTERVAL)
+
+    shard_paths = [_spool_path(spool_dir, "shards", shard_name + ".pdf") for shard_name in plan["shards"]]
+    merge_shards(shard_paths, plan["output"])
+    for shard_path, shard_file in zip(shard_paths, shard_files):
+        os.remove(shard_path)
+        os.remove(_spool_path(spool_dir, "done", shard_file))
+    os.remove(plan_path)
+    LOGGER.info(f"Merged {len(shard_paths)} shards into {plan['output']}")
+    return plan["output"]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert one huge scanned PDF as page-range shards.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = commands.add_parser("plan", help="queue shard jobs for a PDF")
+    plan_parser.add_argument("pdf_path")
+    plan_parser.add_argument("spool_dir")
+    plan_parser.add_argument("output_path")
+    plan_parser.add_argument("--shard-pages", type=int, default=DEFAULT_SHARD_PAGES)
+    plan_parser.add_argument("--backend", choices=("thread", "process"), default="process")
+    plan_parser.add_argument("--output-mode", choices=("pdf", "overlay"), default="pdf")
+
+    work_parser = commands.add_parser("work", help="convert queued shards")
+    work_parser.add_argument("spool_dir")
+    work_parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+
+    merge_parser = commands.add_parser("merge", help="stitch a finished job's shards together")
+    merge_parser.add_argument("spool_dir")
+    merge_parser.add_argument("job_id")
+    merge_parser.add_argument("--no-wait", action="store_true")
+    merge_parser.add_argument("--timeout", type=float, default=MERGE_TIMEOUT,
+                              help="seconds to wait for the shards (default: %(default)s)")
+
+    args = parser.parse_args(argv)
+    if args.command == "plan":
+        print(plan_shards(args.pdf_path, args.spool_dir, args.output_path, args.shard_pages,
+                          backend=args.backend, output_mode=args.output_mode))
+    elif args.command == "work":
+        run_worker(args.spool_dir, once=args.once)
+    else:
+        merge_plan(args.spool_dir, args.job_id, wait=not args.no_wait, timeout=args.timeout)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+import io
+import os
+import mmap
+import hashlib
+import logging
+import threading
+import fitz  # PyMuPDF
+
+LOGGER = logging.getLogger(__name__)
+
+# Bytes hashed from each end of a file to fingerprint it without reading all of it
+FINGERPRINT_BLOCK = 1 << 16
+
+# Read buffer of the file-like views handed to pypdf, python-docx and zipfile
+STREAM_BUFFER = 1 << 16
+
+# Mapped sources by absolute path; an entry lives while it has users
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+class MappedReader(io.RawIOBase):
+    """Read-only, seekable file over a source's buffer, with its own position.
+
+    Reads copy out of the buffer rather than export it, so an open reader never keeps
+    the mapping from being closed; reading after that raises ValueError.
+    """
+
+    def __init__(self, data):
+        super().__init__()
+        self._data = data
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        chunk = self._data[self._pos:self._pos + len(b)]
+        b[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._data)
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+class SourceFile:
+    """A source document mapped into memory once and shared by everything that reads it.
+
+    Get one with open_source(); while it is open, every open_source() of the same
+    unchanged file in this process returns it too. Readers whose uses overlap therefore
+    share one read of the file: a conversion's document, journal fingerprint and writer,
+    or detection's fingerprint and parse. Uses that do not overlap (detection, then a
+    later conversion) each map the file again, and process-pool and pipeline workers
+    open it by path themselves. PyMuPDF opens the buffer with open_pdf(); pypdf,
+    python-docx and zipfile take the file-like objects from open_stream(). The mapping
+    is closed once the last user closes it and every document from open_pdf() has been
+    closed.
+
+    Files that cannot be mapped (some network filesystems, empty files) are read into
+    memory instead.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.size = stat.st_size
+            self.version = (stat.st_size, stat.st_mtime_ns)
+            self._map = None
+            if self.size:
+                try:
+                    self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except OSError as e:
+                    LOGGER.debug(f"Cannot map {os.path.basename(path)}, reading it instead - {e}")
+            self.data = self._map if self._map is not None else f.read()
+        self.users = 0
+        self._documents = []  # (document, buffer view) pairs handed to PyMuPDF
+        self._fingerprint = None
+
+    def fingerprint(self):
+        """Return a cache key made of the file size and a hash of its first and last blocks."""
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=20)
+            digest.update(self.data[:FINGERPRINT_BLOCK])
+            if self.size > 2 * FINGERPRINT_BLOCK:
+                digest.update(self.data[-FINGERPRINT_BLOCK:])
+            self._fingerprint = f"{self.size}:{digest.hexdigest()}"
+        return self._fingerprint
+
+    def open_pdf(self):
+        """Open the source with PyMuPDF, straight from the buffer."""
+        view = memoryview(self.data)
+        document = fitz.open(stream=view, filetype="pdf")
+        self._documents.append((document, view))
+        return document
+
+    def open_stream(self):
+        return io.BufferedReader(MappedReader(self.data), STREAM_BUFFER)
+
+    def copy_to(self, output_path):
+        with open(output_path, 'wb') as f:
+            f.write(self.data)
+
+    def close(self):
+        """Give up one use of the source; the last one unmaps it."""
+        with _sources_lock:
+            self.users -= 1
+            if self.users > 0:
+                return
+            if _sources.get(self.path) is self:
+                del _sources[self.path]
+        if self._map is None:
+            return
+        if any(not document.is_closed for document, _ in self._documents):
+            # Still being read; the mapping goes once those documents are collected
+            LOGGER.warning(f"{os.path.basename(self.path)} closed while a document on it is open")
+            return
+        # PyMuPDF holds on to its buffer after close(), so let go of it here
+        for _, view in self._documents:
+            view.release()
+        self._documents = []
+        try:
+            self._map.close()
+        except BufferError:
+            LOGGER.warning(f"{os.path.basename(self.path)} is still mapped by a view of its buffer")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_source(path):
+    """Return the SourceFile for path, shared with any other open use of the same file.
+
+    A use that finds the file changed since it was mapped gets a fresh mapping; the old
+    one stays with its users until they close it. Use it as a context manager, or call
+    close() once done. OSError is raised when the file cannot be opened.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    with _sources_lock:
+        source = _sources.get(path)
+        if source is not None and source.version == (stat.st_size, stat.st_mtime_ns):
+            source.users += 1
+            return source
+    source = SourceFile(path)
+    with _sources_lock:
+        current = _sources.get(path)
+        if current is not None and current.version == source.version:
+            # Another thread mapped it first
+            current.users += 1
+            source.users = 1
+        else:
+            _sources[path] = source
+            source.users += 1
+            return source
+    source.close()
+    return current
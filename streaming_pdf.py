@@ -0,0 +1,269 @@
+import weakref
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    EncodedStreamObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    NullObject,
+    NumberObject,
+    RectangleObject,
+    StreamObject,
+)
+
+# Object numbers reserved for the document catalog and the page tree, written on close
+CATALOG_NUM = 1
+PAGES_NUM = 2
+
+# Page keys that are rebuilt rather than copied. Article beads point into threads that
+# span the whole source document, so they are dropped.
+REBUILT_PAGE_KEYS = ("/Parent", "/Contents", "/MediaBox", "/CropBox", "/TrimBox", "/BleedBox", "/ArtBox",
+                     "/Annots", "/B")
+
+# Page attributes that may be inherited from the page tree
+INHERITED_PAGE_KEYS = ("/Resources", "/Rotate")
+
+# Page boundaries other than the media box, carried over in the page's new coordinates
+PAGE_BOXES = ("/CropBox", "/TrimBox", "/BleedBox", "/ArtBox")
+
+# Annotation entries holding x, y coordinate pairs in page space
+ANNOTATION_POINT_KEYS = ("/Rect", "/QuadPoints", "/L", "/Vertices", "/CL")
+
+
+def _inherited(page, key):
+    """A page attribute, looked up the page tree when the page does not set it."""
+    node = page
+    while node is not None:
+        node = node.get_object()
+        if key in node:
+            return node[key]
+        node = node.get("/Parent")
+    return None
+
+
+def _transform_points(values, transform):
+    """Map a flat [x1 y1 x2 y2 ...] list through (scale_x, scale_y, offset_x, offset_y)."""
+    scale_x, scale_y, offset_x, offset_y = transform
+    return [FloatObject(round(float(value) * scale_x + offset_x, 6)) if i % 2 == 0
+            else FloatObject(round(float(value) * scale_y + offset_y, 6))
+            for i, value in enumerate(values)]
+
+
+class StreamingPdfWriter:
+    """Write a PDF page by page, straight to disk.
+
+    Each added page's objects are renumbered and written out immediately, so memory use
+    does not grow with the page data; only the object offsets, for the xref table written
+    by close(), and the numbers given to each source reader's objects are kept. Objects
+    shared between pages of one reader (fonts, images) are therefore written once. Pages
+    come from pypdf (e.g. a PdfReader's pages).
+
+    Page boxes and annotations are carried over in the page's new coordinates. A
+    reference to a source page (a link destination, an annotation's /P) points at that
+    page in the output once it is added, and at null if it never is.
+    """
+
+    def __init__(self, output_path):
+        self.file = open(output_path, 'wb')
+        self.file.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self.offsets = {}
+        self.next_num = PAGES_NUM + 1
+        self.page_refs = ArrayObject()
+        self.mappings = weakref.WeakKeyDictionary()  # source reader -> {object key: number}
+        self.unwritten_pages = set()  # numbers reserved for source pages referenced but not added
+
+    def _reserve(self):
+        num = self.next_num
+        self.next_num += 1
+        return num
+
+    def _write_object(self, num, obj):
+        self.offsets[num] = self.file.tell()
+        self.file.write(f"{num} 0 obj\n".encode("ascii"))
+        obj.write_to_stream(self.file)
+        self.file.write(b"\nendobj\n")
+
+    def _copy(self, obj, mapping, pending):
+        """Return obj with its references renumbered, queueing newly referenced objects."""
+        if isinstance(obj, IndirectObject):
+            key = (id(obj.pdf), obj.idnum, obj.generation)
+            if key not in mapping:
+                mapping[key] = self._reserve()
+                target = obj.get_object()
+                if isinstance(target, DictionaryObject) and target.get("/Type") == "/Page":
+                    # Filled in if the page is added, rather than copying it (and through
+                    # its /Parent, the whole source page tree) here
+                    self.unwritten_pages.add(mapping[key])
+                else:
+                    pending.append((mapping[key], target))
+            return IndirectObject(mapping[key], 0, None)
+        if isinstance(obj, StreamObject):
+            # Streams are only legal as indirect objects
+            num = self._reserve()
+            pending.append((num, obj))
+            return IndirectObject(num, 0, None)
+        if isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+            for key, value in obj.items():
+                copy[NameObject(key)] = self._copy(value, mapping, pending)
+            return copy
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self._copy(value, mapping, pending) for value in obj)
+        return obj
+
+    def _copy_stream(self, obj, mapping, pending):
+        # Filtered streams are copied still encoded; unfiltered ones via their data
+        if "/Filter" in obj:
+            copy = EncodedStreamObject()
+            copy._data = obj._data
+        else:
+            copy = DecodedStreamObject()
+            copy.set_data(obj.get_data())
+        for key, value in obj.items():
+            if key != "/Length":
+                copy[NameObject(key)] = self._copy(value, mapping, pending)
+        return copy
+
+    def _flush(self, mapping, pending):
+        while pending:
+            num, obj = pending.pop()
+            if isinstance(obj, StreamObject):
+                obj = self._copy_stream(obj, mapping, pending)
+            else:
+                obj = self._copy(obj, mapping, pending)
+            self._write_object(num, obj)
+
+    def add_page(self, page, width=None, height=None):
+        """Write a pypdf page, scaled to width x height points when given."""
+        mediabox = page.mediabox
+        width = width or float(mediabox.width)
+        height = height or float(mediabox.height)
+        scale_x = width / float(mediabox.width)
+        scale_y = height / float(mediabox.height)
+
+        contents = page.get("/Contents")
+        contents = contents.get_object() if contents is not None else None
+        if contents is None:
+            data = b""
+        elif isinstance(contents, ArrayObject):
+            data = b"\n".join(part.get_object().get_data() for part in contents)
+        else:
+            data = contents.get_data()
+        content_stream = DecodedStreamObject()
+        content_stream.set_data(
+            f"q {scale_x:.6f} 0 0 {scale_y:.6f} {-float(mediabox.left) * scale_x:.6f} "
+            f"{-float(mediabox.bottom) * scale_y:.6f} cm\n".encode("ascii") + data + b"\nQ"
+        )
+
+        mapping = self._mapping(page.pdf)
+        pending = []
+        page_num = self._page_number(page, mapping)
+        # The same transform the content gets: the media box onto [0 0 width height]
+        transform = (scale_x, scale_y, -float(mediabox.left) * scale_x, -float(mediabox.bottom) * scale_y)
+
+        page_dict = DictionaryObject()
+        for key, value in page.items():
+            if key not in REBUILT_PAGE_KEYS:
+                page_dict[NameObject(key)] = self._copy(value, mapping, pending)
+        for key in INHERITED_PAGE_KEYS:
+            if key not in page_dict:
+                value = _inherited(page, key)
+                if value is not None:
+                    page_dict[NameObject(key)] = self._copy(value, mapping, pending)
+        for key in PAGE_BOXES:
+            box = _inherited(page, key) if key == "/CropBox" else page.get(key)
+            if box is not None:
+                page_dict[NameObject(key)] = RectangleObject(_transform_points(box.get_object(), transform))
+        annots = page.get("/Annots")
+        if annots is not None:
+            page_dict[NameObject("/Annots")] = self._copy_annotations(annots.get_object(), transform, mapping, pending)
+        page_dict[NameObject("/Type")] = NameObject("/Page")
+        page_dict[NameObject("/Parent")] = IndirectObject(PAGES_NUM, 0, None)
+        page_dict[NameObject("/MediaBox")] = RectangleObject([0, 0, width, height])
+        page_dict[NameObject("/Contents")] = self._copy(content_stream.flate_encode(), mapping, pending)
+        self._flush(mapping, pending)
+
+        self._write_object(page_num, page_dict)
+        self.page_refs.append(IndirectObject(page_num, 0, None))
+
+    def _mapping(self, reader):
+        """The object numbers given to reader's objects so far, kept while reader lives."""
+        if reader is None:
+            return {}
+        return self.mappings.setdefault(reader, {})
+
+    def _page_number(self, page, mapping):
+        """The number to write page under: the one reserved for it if it was referenced."""
+        ref = page.indirect_reference
+        if ref is None:
+            return self._reserve()
+        key = (id(ref.pdf), ref.idnum, ref.generation)
+        if key in mapping:
+            self.unwritten_pages.discard(mapping[key])
+        else:
+            mapping[key] = self._reserve()
+        return mapping[key]
+
+    def _copy_annotations(self, annots, transform, mapping, pending):
+        """Copy a page's annotations with their coordinates transformed like its content.
+
+        Every annotation of the page is given its number up front, so a popup referred
+        to from its parent is still the transformed copy.
+        """
+        copies = []
+        for annot in annots:
+            target = annot.get_object()
+            if not isinstance(target, DictionaryObject):
+                continue
+            moved = DictionaryObject(target)
+            for key in ANNOTATION_POINT_KEYS:
+                if key in moved:
+                    moved[NameObject(key)] = ArrayObject(_transform_points(moved[key].get_object(), transform))
+            if "/InkList" in moved:
+                moved[NameObject("/InkList")] = ArrayObject(
+                    ArrayObject(_transform_points(path.get_object(), transform)) for path in moved["/InkList"])
+            if isinstance(annot, IndirectObject):
+                key = (id(annot.pdf), annot.idnum, annot.generation)
+                if key not in mapping:
+                    mapping[key] = self._reserve()
+                    pending.append((mapping[key], moved))
+                copies.append(IndirectObject(mapping[key], 0, None))
+            else:
+                copies.append(self._copy(moved, mapping, pending))
+        return ArrayObject(copies)
+
+    def close(self):
+        """Write the page tree, catalog, xref table and trailer, then close the file."""
+        pages = DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): self.page_refs,
+            NameObject("/Count"): NumberObject(len(self.page_refs)),
+        })
+        self._write_object(PAGES_NUM, pages)
+        catalog = DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(PAGES_NUM, 0, None),
+        })
+        self._write_object(CATALOG_NUM, catalog)
+        for num in sorted(self.unwritten_pages):
+            self._write_object(num, NullObject())
+
+        xref_offset = self.file.tell()
+        self.file.write(f"xref\n0 {self.next_num}\n".encode("ascii"))
+        self.file.write(b"0000000000 65535 f \n")
+        for num in range(1, self.next_num):
+            self.file.write(f"{self.offsets[num]:010d} 00000 n \n".encode("ascii"))
+        self.file.write(f"trailer\n<< /Size {self.next_num} /Root {CATALOG_NUM} 0 R >>\n".encode("ascii"))
+        self.file.write(f"startxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
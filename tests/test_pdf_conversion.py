@@ -0,0 +1,22 @@
+import os
+import fitz  # PyMuPDF
+from pdf_conversion import add_text_layer
+
+SAMPLE = os.path.join(os.path.dirname(__file__), os.pardir, "test1_scanned.pdf")
+
+
+def test_text_layer_is_extractable_on_unwrapped_page():
+    # The sample's content is a bare "cm ... Do" with no q/Q around it
+    with fitz.open(SAMPLE) as pdf_document:
+        page = pdf_document[0]
+        assert not page.is_wrapped
+        ocr_result = {
+            "size": (1000, 1000),
+            "rect": tuple(page.rect),
+            "words": [
+                {"text": "Searchable", "left": 100, "top": 100, "width": 300, "height": 40, "conf": 95.0},
+                {"text": "overlay", "left": 450, "top": 100, "width": 220, "height": 40, "conf": 93.0},
+            ],
+        }
+        add_text_layer(page, ocr_result)
+        assert page.get_text().split() == ["Searchable", "overlay"]
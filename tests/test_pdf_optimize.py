@@ -0,0 +1,14 @@
+import os
+import fitz  # PyMuPDF
+from pdf_optimize import classify_image, load_image
+
+SAMPLE = os.path.join(os.path.dirname(__file__), os.pardir, "test1_scanned.pdf")
+
+
+def test_one_bit_scan_is_bitonal():
+    with fitz.open(SAMPLE) as pdf_document:
+        xref = pdf_document[0].get_images()[0][0]
+        img, kind = load_image(pdf_document, xref)
+    assert kind == "bitonal"
+    # Classifying the pixels alone must agree: text edges are not midtones
+    assert classify_image(img) == "bitonal"